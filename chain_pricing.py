@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from models.batch import chain_inputs
+from models.black_scholes import BlackScholes
+from models.binomial_tree import BaseBinomialTree
+from models.implied_vol import implied_volatility
+
+CHAIN_MODELS = {
+    "eu": ["Black Scholes", "Binomial Tree"],
+    "us": ["Binomial Tree"],
+}
+
+def _rows(value, start, stop):
+    # per-row inputs (e.g. a spot per contract) are sliced alongside the chunk; scalars are shared
+    if isinstance(value, pd.Series):
+        return value.iloc[start:stop]
+    if isinstance(value, (np.ndarray, list)):
+        return value[start:stop]
+    return value
+
+def _price_chunk(chunk, market, model, region, greeks, steps, method):
+    # the models' own batch entry points price each chunk, so there is one chain pricer per model
+    if model == "Black Scholes":
+        return BlackScholes.price_chain(chunk, *market, greeks=greeks)
+    return BaseBinomialTree.price_chain(chunk, *market, american=region == "us", steps=steps, method=method,
+                                        greeks=greeks)
+
+def stream_priced_chain(contracts: pd.DataFrame, spot, maturity=None, risk_free_rate=0.0, dividend_rate=0.0,
+                        model="Binomial Tree", region="us", chunk_size=500, greeks=True, steps=100, method="crr",
+                        solve_iv=False):
+    # prices the chain chunk by chunk so a UI can render each partial table as soon as it is ready
+    if model not in CHAIN_MODELS.get(region, []):
+        raise Exception(f"<Chain> {model} can't batch-price {region.upper()} contracts - Options: {CHAIN_MODELS.get(region, [])}")
+
+    for start in range(0, len(contracts), chunk_size):
+        stop = start + chunk_size
+        chunk = contracts.iloc[start:stop]
+        market = [_rows(x, start, stop) for x in (spot, maturity, risk_free_rate, dividend_rate)]
+
+        priced = _price_chunk(chunk, market, model, region, greeks, steps, method)
+        if "Mark" in priced:
+            priced["Model Diff"] = priced["NPV"] - priced["Mark"]
+        if solve_iv and "Mark" in priced:
+            inputs = chain_inputs(chunk, *market)
+            solved = implied_volatility(priced["Mark"].to_numpy(dtype=float), inputs["option_type"], inputs["spot"],
+                                        inputs["strike"], inputs["time"], inputs["risk_free_rate"],
+                                        inputs["dividend_rate"], model=model, steps=steps, method=method,
+                                        american=region == "us")
+            priced["Model IV"] = solved["implied_volatility"]
+            priced["IV Converged"] = solved["converged"]
+            priced["IV Iterations"] = solved["iterations"]
+        yield priced
+
+def price_chain(contracts: pd.DataFrame, spot, **kwargs):
+    chunks = list(stream_priced_chain(contracts, spot, **kwargs))
+    return pd.concat(chunks) if chunks else contracts.copy()
@@ -6,7 +6,7 @@ from datetime import datetime, date, timedelta
 from models.abstract import inputs
 from models.openai_env import OptionEnv
 from models.baseline_tfa_dqn import TFAModel
-from option_types import MODELS, USOption, EUOption, ASOption
+from option_types import MODELS, POLICY_REGISTRY, USOption, EUOption, ASOption
 
 from polygon import Polygon
 from utils.tickers import read_tickers
@@ -145,6 +145,8 @@ with american:
 
         for priced_option in priced_options:
             priced_option.st_visualize()
+        for failed_model, error in getattr(opt, "failures", {}).items():
+            st.error(f"{failed_model} failed: {error}")
 with eu:
     st.info("Price a Custom European Option")
     with st.form("euro-price"):
@@ -170,6 +172,8 @@ with eu:
 
         for priced_option in priced_options:
             priced_option.st_visualize()
+        for failed_model, error in getattr(opt, "failures", {}).items():
+            st.error(f"{failed_model} failed: {error}")
 with asia:
     st.info("Price a Custom Asian Option")
     with st.form("asia-price"):
@@ -195,6 +199,8 @@ with asia:
 
         for priced_option in priced_options:
             priced_option.st_visualize()
+        for failed_model, error in getattr(opt, "failures", {}).items():
+            st.error(f"{failed_model} failed: {error}")
 with dqn:
     st.info("Deep Q-Network Breakdown")
     st.subheader("Test Option Specs")
@@ -229,12 +235,20 @@ with dqn:
         st.subheader("Model")
         tfa = TFAModel(OptionEnv, test_defs, iterations=n_iterations, eval_interval=eval_interval, log_interval=log_interval, n_sims=n_sims)
         with st.status("Building Model...", expanded=True) as status:
-            st.write("Initializing Agent...")
-            tfa.init_agent()
-            st.write("Done | Building Replay Buffer...")
-            tfa.build_replay_buffer()
-            st.write("Done | Preparing to Train...")
-            tfa.train()
+            # same flow as USOption, except a registered policy is only reused when it trained at least as long
+            # as requested - otherwise the demo warm-starts from it and trains
+            if tfa.load_policy(POLICY_REGISTRY, min_train_steps=n_iterations):
+                st.write("Loaded a registered policy for this option")
+            else:
+                st.write("Initializing Agent...")
+                tfa.init_agent()
+                st.write("Done | Building Replay Buffer...")
+                tfa.build_replay_buffer()
+                if tfa.warm_start(POLICY_REGISTRY):
+                    st.write("Done | Warm-started from a registered policy")
+                st.write("Done | Preparing to Train...")
+                tfa.train()
+                tfa.save_policy(POLICY_REGISTRY)
             status.update(label="Model Built - Pricing Option", state="running", expanded=True)
             tfa.calculate_npv()
             status.update(label="Option Pricing Complete", state="complete", expanded=False)
@@ -3,13 +3,31 @@ import streamlit as st
 
 from abc import ABC, abstractmethod
 from datetime import date, timedelta
-from torch import tensor
+from torch import tensor, is_tensor
+
+def detached(value):
+    # autograd graphs can't be pickled, only the numbers they hold
+    if is_tensor(value):
+        return value.detach()
+    if isinstance(value, dict):
+        return {k: detached(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(detached(v) for v in value)
+    return value
+
+def resolve_rate(params):
+    # a rate curve (anything with zero_rate) is read at the option's own maturity
+    rate = params.get("risk_free_rate")
+    if hasattr(rate, "zero_rate") and "maturity" in params:
+        params["risk_free_rate"] = rate.zero_rate((params["maturity"] - date.today()) / timedelta(days=365))
+    return params
 
 class BaseOption(ABC):
     def __init__(self, params, with_tensors=False):
         try:
             self._maturity = params["maturity"]
             params["time"] = (self._maturity - date.today()) / timedelta(days=365)
+            resolve_rate(params)
             self._option_type = params["option_type"]
 
             self._spot = params["spot"]
@@ -62,6 +80,7 @@ class Model(BaseOption):
         self._name = name
 
         try:
+            resolve_rate(params)
             if with_tensors:
                 params = {k: (tensor(v, requires_grad=True) 
                               if k not in ("option_type", "maturity") else v) 
@@ -74,6 +93,34 @@ class Model(BaseOption):
             st.error(msg)
             raise Exception(msg)
     
+    def _input_key(self):
+        values = (self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d)
+        return tuple(v.item() if hasattr(v, "item") else v for v in values)
+
+    def _cached(self, name, compute):
+        # npv/greeks/diagnostics are memoized per instance and dropped as soon as a pricing input changes
+        key = self._input_key()
+        if getattr(self, "_results", None) is None or self._results["inputs"] != key:
+            self._results = {"inputs": key}
+        if name not in self._results:
+            self._results[name] = compute()
+        return self._results[name]
+
+    def clear_cache(self):
+        self._results = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if state.get("_results") is not None:
+            state["_results"] = detached(state["_results"])
+        return state
+
+    def evaluate(self):
+        # forces the lazy results, e.g. before handing the model to a cache
+        self.npv
+        getattr(self, "greeks", None)
+        return self
+
     @property
     @abstractmethod
     def npv(self):
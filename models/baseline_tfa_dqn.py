@@ -1,17 +1,35 @@
+import os
+import time
 import tensorflow as tf
 import streamlit as st
 import pandas as pd
-from models.monte_carlo import dqn_sim
+from models.monte_carlo import dqn_sim, dqn_batch_sim
 
 from tf_agents.environments import  gym_wrapper           # wrap OpenAI gym
 from tf_agents.environments import tf_py_environment      # gym to tf gym
 from tf_agents.networks import q_network                  # Q net
 from tf_agents.agents.dqn import dqn_agent                # DQN Agent
 from tf_agents.replay_buffers import tf_uniform_replay_buffer      # replay buffer
-from tf_agents.trajectories import trajectory              # s->s' trajectory
+from tf_agents.drivers import dynamic_step_driver         # env <-> policy loop
+from tf_agents.policies import random_tf_policy           # warmup policy
+from tf_agents.policies import policy_saver               # SavedModel export
 from tf_agents.utils import common                       # loss function
 
 from models.abstract import Model
+from models.openai_env import OptionEnv
+from models.batched_env import BatchedOptionEnv
+from models.tf_env import TFOptionEnv
+
+
+class RescaledPolicy:
+    # observations hold the raw spot, so a policy trained at another strike sees spots in its own units
+    # (the exercise boundary scales with the strike)
+    def __init__(self, policy, scale):
+        self._policy = policy
+        self._scale = tf.constant([scale, 1.0], tf.float32)
+
+    def action(self, time_step, policy_state=()):
+        return self._policy.action(time_step._replace(observation=time_step.observation * self._scale), policy_state)
 
 
 class TFAModel(Model):
@@ -27,7 +45,10 @@ class TFAModel(Model):
                  eval_interval: int = 5,
                  log_interval: int = 1,
                  debugging = False,
-                 n_sims: int = 10
+                 n_sims: int = 10,
+                 n_envs: int = 32,
+                 in_graph: bool = False,
+                 warmup_steps: int = 1000
                  ): # hyperparameters
         
         self._debugging = debugging
@@ -42,22 +63,44 @@ class TFAModel(Model):
 
         self._eval_interval = eval_interval 
         self._log_interval = log_interval
+        self._n_envs = n_envs
+        self._in_graph = in_graph
+        self._n_sims = n_sims
+        self._warmup_steps = warmup_steps
+        self._throughput, self._traced = {}, set()
+        self._params = params
+        self._policy, self._warm_started = None, None
 
         self._setup_envs(environment, params)
         self._agent, self._repl_buffer = None, None
         self._log, self._returns = None, None
-        self._npv = None
-        self._n_sims = n_sims
+        self._npv, self._stderr = None, None
         self._priced = False
         
     def _setup_envs(self, env, params):
-        train_gym, eval_gym = env(params), env(params)
-        train_gym_wrapper = gym_wrapper.GymWrapper(train_gym)
-        eval_gym_wrapper = gym_wrapper.GymWrapper(eval_gym)
+        # training collects from n_envs paths at once (in-graph or as numpy); evaluation keeps the single-path gym env
+        if self._in_graph and env is OptionEnv:
+            self._train_env = TFOptionEnv(params, batch_size=self._n_envs)
+        elif self._n_envs > 1 and env is OptionEnv:
+            self._train_env = tf_py_environment.TFPyEnvironment(BatchedOptionEnv(params, batch_size=self._n_envs))
+        else:
+            self._train_env = tf_py_environment.TFPyEnvironment(gym_wrapper.GymWrapper(env(params)))
+        eval_gym_wrapper = gym_wrapper.GymWrapper(env(params))
 
-        self._train_env = tf_py_environment.TFPyEnvironment(train_gym_wrapper)
         self._eval_env = tf_py_environment.TFPyEnvironment(eval_gym_wrapper)
 
+        # evaluation & pricing roll every episode out side by side when the option env can be batched
+        self._eval_batch_env, self._sim_env = None, None
+        if env is OptionEnv:
+            batched = lambda n: TFOptionEnv(params, batch_size=n) if self._in_graph \
+                else tf_py_environment.TFPyEnvironment(BatchedOptionEnv(params, batch_size=n))
+            self._eval_batch_env, self._sim_env = batched(self._num_eval_episodes), batched(self._n_sims)
+
+    def _average_return(self):
+        if self._eval_batch_env is not None:
+            return dqn_batch_sim(self._agent.policy, self._eval_batch_env)[0]
+        return dqn_sim(self._agent.policy, self._eval_env, eps=self._num_eval_episodes)
+
     def init_agent(self):
         q_net = q_network.QNetwork(
             self._train_env.observation_spec(),
@@ -79,16 +122,38 @@ class TFAModel(Model):
         
         self._agent.initialize()
     
-    def _collect_step(self, env, policy, buffer):
-        time_step = env.current_time_step()
-        action_step = policy.action(time_step)
-        next_time_step = env.step(action_step.action)
-        trj = trajectory.from_transition(time_step, action_step, next_time_step)
+    def _collect_data(self, driver, stage, steps):
+        # one compiled driver run of `steps` transitions (summed over the env batch); a driver's first run
+        # traces & instantiates its graph, so it is left out of the throughput
+        if driver not in self._traced:
+            driver.run()
+            self._traced.add(driver)
+            return
+        start = time.perf_counter()
+        driver.run()
+        frames, seconds = self._throughput.get(stage, (0, 0.0))
+        self._throughput[stage] = (frames + steps, seconds + time.perf_counter() - start)
 
-        buffer.add_batch(trj)
-    
-    def _collect_data(self, env, policy, buffer, steps):
-        (self._collect_step(env, policy, buffer) for _ in range(steps))
+    def _build_drivers(self):
+        observers = [self._repl_buffer.add_batch]
+        random_policy = random_tf_policy.RandomTFPolicy(self._train_env.time_step_spec(), self._train_env.action_spec())
+
+        self._collect_frames = self._collect_steps_per_iteration * self._train_env.batch_size
+        # warmup runs in collect-sized pieces so it still has timed runs once the first (tracing) run is excluded
+        self._warmup_runs = -(-self._warmup_steps // self._collect_frames)
+        self._warmup_frames = -(-self._warmup_steps // max(self._warmup_runs, 1))
+        self._warmup_driver = dynamic_step_driver.DynamicStepDriver(
+            self._train_env, random_policy, observers=observers, num_steps=self._warmup_frames)
+        self._collect_driver = dynamic_step_driver.DynamicStepDriver(
+            self._train_env, self._agent.collect_policy, observers=observers, num_steps=self._collect_frames)
+
+        self._warmup_driver.run = common.function(self._warmup_driver.run)
+        self._collect_driver.run = common.function(self._collect_driver.run)
+
+    @property
+    def collection_throughput(self):
+        # steps/sec per collection stage (warmup & collect)
+        return {stage: frames / seconds for stage, (frames, seconds) in self._throughput.items() if seconds > 0}
     
     def build_replay_buffer(self):
         if self._agent is None:
@@ -97,7 +162,8 @@ class TFAModel(Model):
         self._repl_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
             data_spec=self._agent.collect_data_spec,
             batch_size=self._train_env.batch_size,
-            max_length=self._replay_buffer_max_length
+            # max_length is per env in the batch; repbuffer_len stays the total capacity
+            max_length=max(1, self._replay_buffer_max_length // self._train_env.batch_size)
         )
 
         dataset = self._repl_buffer.as_dataset(
@@ -106,13 +172,13 @@ class TFAModel(Model):
             num_steps=2).prefetch(3)
         
         self._iterator = iter(dataset)
+        self._build_drivers()
     
     def _train_iteration(self):
-        for n in range(self._collect_steps_per_iteration):
-            if self._debugging:
-                with open("data/dqn_log.txt", "a") as f:
-                    f.write(f"collecting [step = {n}] ...\n")
-            self._collect_step(self._train_env, self._agent.collect_policy, self._repl_buffer)
+        if self._debugging:
+            with open("data/dqn_log.txt", "a") as f:
+                f.write(f"collecting [{self._collect_frames} steps] ...\n")
+        self._collect_data(self._collect_driver, "collect", self._collect_frames)
         
         exp, _ = next(self._iterator)
         train_loss = self._agent.train(exp).loss
@@ -128,7 +194,7 @@ class TFAModel(Model):
             self._log.append((f"step = {step}", f"loss = {train_loss}"))
         
         if step % self._eval_interval == 0:
-            avg_return = dqn_sim(self._agent.policy, self._eval_env, eps=self._num_eval_episodes)
+            avg_return = self._average_return()
             self._log.append((f"step = {step}", f"Average Return = {avg_return}"))
             self._returns.append(avg_return)
 
@@ -140,9 +206,15 @@ class TFAModel(Model):
 
         self._agent.train_step_counter.assign(0)
 
-        avg_return = dqn_sim(self._agent.policy, self._eval_env, eps=self._num_eval_episodes)
+        # seed the buffer with random-policy transitions so the first updates don't sample a near-empty buffer
+        for _ in range(self._warmup_runs):
+            self._collect_data(self._warmup_driver, "warmup", self._warmup_frames)
+
+        avg_return = self._average_return()
 
         self._log, self._returns = [("Step = 0", f"Average Return = {avg_return}")], [avg_return]
+        if self._warm_started is not None:
+            self._log.insert(0, ("Step = 0", f"Warm-started from policy {self._warm_started}"))
 
         if not self._debugging:
             bar = st.progress(0.0, text=f"Training Model... (0/{self._num_iterations} Iterations Complete)")
@@ -158,6 +230,8 @@ class TFAModel(Model):
             self._train_iteration()
         if not self._debugging:
             bar.progress(1.0, text="Model Trained")
+        for stage, rate in self.collection_throughput.items():
+            self._log.append((f"{stage} collection", f"{rate:,.0f} steps/sec"))
     
     @property
     def train_iteration_dict(self):
@@ -183,14 +257,62 @@ class TFAModel(Model):
     def train_returns(self):
         return self._returns
 
+    @property
+    def policy(self):
+        # a policy loaded from the registry stands in for the agent's
+        return self._policy if self._policy is not None else self._agent.policy
+
+    def load_policy(self, registry, min_train_steps=0):
+        # a registered policy trained for fewer than min_train_steps isn't good enough to skip training
+        entry = registry.entry(self._params)
+        if entry is None or entry["train_steps"] < min_train_steps:
+            return False
+
+        start = time.perf_counter()
+        self._policy = RescaledPolicy(tf.saved_model.load(entry["policy"]), entry["strike"] / float(self._params["strike"]))
+        self._log = [("Step = 0", f"Loaded policy {entry['key']} ({entry['train_steps']} train steps) in {time.perf_counter() - start:.3f}s")]
+        self._returns = []
+        return True
+
+    def warm_start(self, registry):
+        # start training from the nearest registered agent's weights instead of a fresh q-network
+        if self._agent is None:
+            raise Exception("Agent has not been initialized")
+        entry = registry.nearest(self._params)
+        if entry is None:
+            return None
+
+        common.Checkpointer(ckpt_dir=entry["checkpoint"], agent=self._agent).initialize_or_restore().expect_partial()
+        self._warm_started = entry["key"]
+        return entry["key"]
+
+    def save_policy(self, registry):
+        train_steps = self._agent.train_step_counter.numpy()
+        if not registry.supersedes(self._params, train_steps):
+            return registry.entry(self._params) # a shorter run doesn't replace a better-trained policy
+        path = registry.path(registry.key(self._params))
+        policy_saver.PolicySaver(self._agent.policy, batch_size=None).save(os.path.join(path, "policy"))
+        # the replay buffer stays out: warm starts only restore the agent, and the buffer dwarfs the network
+        common.Checkpointer(ckpt_dir=os.path.join(path, "checkpoint"), max_to_keep=1, agent=self._agent,
+                            policy=self._agent.policy,
+                            global_step=self._agent.train_step_counter).save(self._agent.train_step_counter)
+        return registry.register(self._params, train_steps)
+
     def calculate_npv(self):
-        self._npv = dqn_sim(self._agent.policy, self._eval_env, eps=self._n_sims, st_display=True)
+        if self._sim_env is not None:
+            self._npv, self._stderr = dqn_batch_sim(self.policy, self._sim_env)
+        else:
+            self._npv = dqn_sim(self.policy, self._eval_env, eps=self._n_sims, st_display=True)
         self._priced = True
     
     @property 
     def npv(self):
         return self._npv
 
+    @property
+    def stderr(self):
+        return self._stderr
+
     def __str__(self):
         return f"Option Price (Deep Q-Network): ${self.npv}"
     
@@ -199,10 +321,13 @@ class TFAModel(Model):
             st.error("Option Not Yet Priced")
             return
         st.success(str(self))
+        if self._stderr is not None:
+            st.caption(f"Standard Error: {self._stderr:.6f} ({self._n_sims} Episodes)")
         st.divider()
         st.subheader("Train Iteration Log")
         st.dataframe(self.train_log, use_container_width=True)
         st.divider()
-        st.subheader("Graphed Average Returns")
-        st.line_chart(self.train_iteration_dict, x="Iterations", y="Average Return" )
-        st.divider()
+        if self._returns:
+            st.subheader("Graphed Average Returns")
+            st.line_chart(self.train_iteration_dict, x="Iterations", y="Average Return" )
+            st.divider()
@@ -0,0 +1,44 @@
+# Columnar inputs for pricing whole option chains in one pass
+import numpy as np
+import pandas as pd
+
+from datetime import date, timedelta
+
+def year_fraction(maturity, today=None):
+    today = date.today() if today is None else today
+    if isinstance(maturity, (pd.Series, pd.Index, np.ndarray, list)):
+        maturities = pd.to_datetime(pd.Series(maturity)).dt.date
+        return np.array([(m - today) / timedelta(days=365) for m in maturities], dtype=np.float64)
+    return (maturity - today) / timedelta(days=365)
+
+def parse_implied_volatility(values):
+    # yahoo_fin reports IV as strings like "1,234.56%"
+    series = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(series):
+        series = series.astype(str).str.replace(",", "").str.rstrip("%")
+        return pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64) / 100
+    return series.to_numpy(dtype=np.float64)
+
+def chain_inputs(contracts: pd.DataFrame, spot, maturity=None, risk_free_rate=0.0, dividend_rate=0.0):
+    n = len(contracts)
+    if maturity is None:
+        maturity = contracts["expiration"]
+    time = year_fraction(maturity)
+    if hasattr(risk_free_rate, "zero_rate"):
+        risk_free_rate = risk_free_rate.zero_rate(time)
+
+    return {
+        "option_type": contracts["Type"].to_numpy(),
+        "spot": np.broadcast_to(np.asarray(spot, dtype=np.float64), (n,)),
+        "strike": contracts["Strike"].to_numpy(dtype=np.float64),
+        "time": np.broadcast_to(np.asarray(time, dtype=np.float64), (n,)),
+        "implied_volatility": parse_implied_volatility(contracts["Implied Volatility"]),
+        "risk_free_rate": np.broadcast_to(np.asarray(risk_free_rate, dtype=np.float64), (n,)),
+        "dividend_rate": np.broadcast_to(np.asarray(dividend_rate, dtype=np.float64), (n,)),
+    }
+
+def attach_columns(contracts: pd.DataFrame, results: dict):
+    priced = contracts.copy()
+    for name, values in results.items():
+        priced[name.upper() if name == "npv" else name.title()] = values
+    return priced
@@ -0,0 +1,85 @@
+# N independent option-exercise episodes advanced together as NumPy arrays
+import numpy as np
+
+from tf_agents.environments import py_environment
+from tf_agents.specs import array_spec
+from tf_agents.trajectories import time_step as ts
+
+from models.openai_env import OptionEnv
+
+class BatchedOptionEnv(py_environment.PyEnvironment):
+    def __init__(self, params, batch_size: int = 32, seed=None):
+        super().__init__()
+        option = OptionEnv(params) # same parameter handling & horizon as the single-path gym env
+        self._spot = option.spot
+        self._strike = option.strike
+        self._r = option.risk_free_rate
+        self._sigma = option.implied_volatility
+        self._n_days = option.n_days
+        self._float_time = option.float_time
+
+        self._batch_size = batch_size
+        self._rng = np.random.default_rng(seed)
+
+        dt = self._float_time / self._n_days
+        self._drift = (self._r - 0.5 * self._sigma ** 2) * dt
+        self._vol = self._sigma * np.sqrt(dt)
+
+        # the specs match what GymWrapper derives from OptionEnv's spaces so agents are interchangeable
+        self._action_spec = array_spec.BoundedArraySpec((), np.int64, minimum=0, maximum=1, name="action")
+        self._observation_spec = array_spec.BoundedArraySpec((2,), np.float32, minimum=[0, 0], maximum=[np.inf, 1.0],
+                                                             name="observation")
+
+        self._s_new = np.full(batch_size, self._spot, dtype=np.float64)
+        self._day_step = np.zeros(batch_size, dtype=np.int64)
+        self._done = np.zeros(batch_size, dtype=bool)
+
+    @property
+    def batched(self):
+        return True
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    def action_spec(self):
+        return self._action_spec
+
+    def observation_spec(self):
+        return self._observation_spec
+
+    def _observation(self):
+        tao = 1.0 - self._day_step / self._n_days
+        return np.stack([self._s_new, tao], axis=1).astype(np.float32)
+
+    def _reset(self):
+        self._s_new[:] = self._spot
+        self._day_step[:] = 0
+        self._done[:] = False
+        return ts.restart(self._observation(), batch_size=self._batch_size)
+
+    def _step(self, action):
+        action = np.asarray(action).reshape(self._batch_size)
+
+        # paths that finished on the previous step start a new episode and ignore their action
+        restarting = self._done
+        exercise = ~restarting & (action == 1)
+        expiring = ~restarting & (action == 0) & (self._day_step >= self._n_days)
+        holding = ~restarting & ~exercise & ~expiring
+
+        payoff = np.maximum(self._strike - self._s_new, 0.0)
+        reward = np.where(exercise, payoff * np.exp(-self._r * self._float_time * (self._day_step / self._n_days)), 0.0)
+        reward = reward + np.where(expiring, payoff * np.exp(-self._r * self._float_time), 0.0)
+
+        shocks = self._rng.standard_normal(self._batch_size)
+        self._s_new = np.where(holding, self._s_new * np.exp(self._drift + self._vol * shocks), self._s_new)
+        self._day_step = self._day_step + holding
+        self._s_new[restarting] = self._spot
+        self._day_step[restarting] = 0
+
+        self._done = exercise | expiring
+        step_type = np.where(restarting, ts.StepType.FIRST, np.where(self._done, ts.StepType.LAST, ts.StepType.MID))
+        return ts.TimeStep(step_type=step_type.astype(np.int32),
+                           reward=reward.astype(np.float32),
+                           discount=np.where(self._done, 0.0, 1.0).astype(np.float32),
+                           observation=self._observation())
@@ -1,15 +1,23 @@
 import QuantLib as ql 
 import streamlit as st
+import pandas as pd
 from datetime import date
 
 from models.abstract import Model
+from models.batch import chain_inputs, attach_columns
+from models.black_scholes import black_scholes_batch
+from models.lattice import lattice_npv, lattice_greeks, convergence_sweep
 
 class BaseBinomialTree(Model):
-    def __init__(self, origin: str, params):
+    def __init__(self, origin: str, params, steps: int = 100, method: str = "crr"):
         self._origin = origin
+        self._steps = steps
+        self._method = method
 
         super().__init__(params, name=f"{origin.upper()}-Centric Binomial Tree")
+        self._setup_quantlib()
 
+    def _setup_quantlib(self):
         otype = ql.Option.Call if self._option_type == "C" else ql.Option.Put
         self._option_data = (otype, self._strike, self._spot, self._iv, self._r, self._d)
         
@@ -20,7 +28,38 @@ class BaseBinomialTree(Model):
         self._start_date = ql.Date().from_date(date.today())
         ql.Settings.instance().evaluationDate = self._start_date
 
-        self._price_dict = self._get_price_dict()
+        self._price_dict = None
+
+    @classmethod
+    def price_chain(cls, contracts: pd.DataFrame, spot, maturity=None, risk_free_rate=0.0, dividend_rate=0.0,
+                    american=True, steps: int = 100, method: str = "crr", greeks=True):
+        inputs = chain_inputs(contracts, spot, maturity, risk_free_rate, dividend_rate)
+        if greeks:
+            return attach_columns(contracts, lattice_greeks(*inputs.values(), steps=steps, method=method, american=american))
+        npv = lattice_npv(*inputs.values(), steps=steps, method=method, american=american)
+        return attach_columns(contracts, {"npv": npv})
+
+    def _lattice_npv(self, american):
+        return float(lattice_npv(self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d,
+                                 steps=self._steps, method=self._method, american=american)[0])
+
+    _ql_attributes = ("_option_data", "_maturity_date", "_dc", "_calendar", "_start_date", "_price_dict")
+
+    def __getstate__(self):
+        # QuantLib handles don't pickle; they are rebuilt on the other side
+        state = super().__getstate__()
+        return {k: v for k, v in state.items() if k not in self._ql_attributes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup_quantlib()
+
+    @property
+    def _ql_price_dict(self):
+        # QuantLib objects are only built for the exposed bsm process
+        if self._price_dict is None:
+            self._price_dict = self._get_price_dict()
+        return self._price_dict
 
     def _get_price_dict(self):
         otype, k, s, sigma, r, d = self._option_data
@@ -47,37 +86,37 @@ class BaseBinomialTree(Model):
     
     @property
     def npv(self):
-        return self._price_dict[self._origin].NPV()
+        return self._cached("npv", lambda: self._lattice_npv(american=self._origin == "us"))
 
     @property
     def baseline(self):
-        return self._price_dict["eu"].NPV()
+        inputs = (self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d)
+        return self._cached("baseline", lambda: float(black_scholes_batch(*inputs, greeks=False)["npv"]))
     
     @property
     def greeks(self):
-        return None
+        return self._cached("greeks", self._lattice_greeks)
+
+    def _lattice_greeks(self):
+        greeks = lattice_greeks(self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d,
+                                steps=self._steps, method=self._method, american=self._origin == "us")
+        return {k: float(v[0]) for k, v in greeks.items() if k != "npv"}
     
     @property
     def bsm(self):
-        return self._price_dict["bsm"]
+        return self._ql_price_dict["bsm"]
 
     @property
     def early_exercise_pnl(self): 
         if self._origin == "eu":
             return None
-        return self._price_dict["us"].NPV() - self._price_dict["eu"].NPV()
+        return self.npv - self.baseline
     
-    def _binomial_price(self, option, bsm_process, steps):
-        binomial_engine = ql.BinomialVanillaEngine(bsm_process, "crr", steps)
-        option.setPricingEngine(binomial_engine)
-        return option.NPV()
-
-    def prices_over_time(self):
-        eu_prices=[]
-        for step in range(2, 200, 1):
-            eu_prices.append(self._binomial_price(self._price_dict["eu"], self.bsm, step))
-        
-        return eu_prices
+    def prices_over_time(self, start: int = 2, stop: int = 200, stride: int = 1, extrapolation=None):
+        inputs = (self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d)
+        sweep = lambda: convergence_sweep(*inputs, steps=range(start, stop, stride), method=self._method,
+                                          extrapolation=extrapolation).tolist()
+        return self._cached(("prices_over_time", start, stop, stride, extrapolation), sweep)
     
     def st_visualize(self):
         st.success(str(self))
@@ -86,6 +125,11 @@ class BaseBinomialTree(Model):
             cola.caption(f"Potential PnL Gained from Early Exercise: ${self.early_exercise_pnl}")
             colb.caption(f"Held Value: ${self.baseline}")
         st.divider()
+        st.subheader("Calculated Greeks")
+        parsed_greeks = [(k.title(), v) for k, v in self.greeks.items()]
+        data = pd.DataFrame(parsed_greeks, columns=["Greek", "Value"])
+        st.dataframe(data, hide_index=True, use_container_width=True)
+        st.divider()
         eu = self.prices_over_time()
         st.subheader("Baseline Value Over Time")
         st.line_chart(eu)
@@ -1,41 +1,111 @@
+import math
 import torch
+import numpy as np
 from torch.distributions import Normal
 
 import streamlit as st
 import pandas as pd
 
 from models.abstract import Model
+from models.batch import chain_inputs, attach_columns
+
+_cdf = Normal(0,1).cdf
+
+def _is_call(option_type):
+    return torch.as_tensor(np.asarray(option_type) == "C")
+
+def bs_npv(option_type, spot, strike, time, iv, r, d):
+    # works on 0-d tensors (single contract) and 1-d tensors (whole chain) alike
+    sqrt_t = torch.sqrt(time)
+    d_1 = (torch.log(spot / strike) + (r - d + torch.square(iv) / 2) * time) / (iv * sqrt_t)
+    d_2 = d_1 - iv * sqrt_t
+
+    df_r, df_d = torch.exp(-r * time), torch.exp(-d * time)
+    C = _cdf(d_1) * spot * df_d - _cdf(d_2) * strike * df_r
+    P = _cdf(-d_2) * strike * df_r - _cdf(-d_1) * spot * df_d
+
+    return torch.where(_is_call(option_type), C, P)
+
+def _pdf(x):
+    return torch.exp(-torch.square(x) / 2) / math.sqrt(2 * math.pi)
+
+def analytic_greeks(option_type, spot, strike, time, iv, r, d):
+    # closed-form Black-Scholes-Merton greeks, dividend yield included; theta is dV/dT like the autograd path
+    is_call = _is_call(option_type)
+    sqrt_t = torch.sqrt(time)
+    d_1 = (torch.log(spot / strike) + (r - d + torch.square(iv) / 2) * time) / (iv * sqrt_t)
+    d_2 = d_1 - iv * sqrt_t
+
+    df_r, df_d = torch.exp(-r * time), torch.exp(-d * time)
+    n_d1 = _pdf(d_1)
+    vega = spot * df_d * n_d1 * sqrt_t
+    decay = spot * df_d * n_d1 * iv / (2 * sqrt_t)
+
+    return {
+        "delta": torch.where(is_call, df_d * _cdf(d_1), -df_d * _cdf(-d_1)),
+        "gamma": df_d * n_d1 / (spot * iv * sqrt_t),
+        "vega": vega,
+        "theta": torch.where(is_call,
+                             decay + r * strike * df_r * _cdf(d_2) - d * spot * df_d * _cdf(d_1),
+                             decay - r * strike * df_r * _cdf(-d_2) + d * spot * df_d * _cdf(-d_1)),
+        "rho": torch.where(is_call, strike * time * df_r * _cdf(d_2), -strike * time * df_r * _cdf(-d_2)),
+        "epsilon": torch.where(is_call, -spot * time * df_d * _cdf(d_1), spot * time * df_d * _cdf(-d_1)),
+        "vanna": -df_d * n_d1 * d_2 / iv,
+        "volga": vega * d_1 * d_2 / iv,
+    }
+
+def autograd_greeks(option_type, spot, strike, time, iv, r, d):
+    # verification path: first order by backward, second order by double backward
+    s, t, sigma, rate, q = (x.detach().clone().requires_grad_() for x in (spot, time, iv, r, d))
+    npv = bs_npv(option_type, s, strike, t, sigma, rate, q)
+    delta, rho, vega, theta, epsilon = torch.autograd.grad(npv.sum(), (s, rate, sigma, t, q), create_graph=True)
+    gamma, vanna = torch.autograd.grad(delta.sum(), (s, sigma), retain_graph=True)
+    volga, = torch.autograd.grad(vega.sum(), sigma)
+
+    greeks = {"delta": delta, "gamma": gamma, "vega": vega, "theta": theta, "rho": rho,
+              "epsilon": epsilon, "vanna": vanna, "volga": volga}
+    return {k: v.detach() for k, v in greeks.items()}
+
+GREEKS_METHODS = {"analytic": analytic_greeks, "autograd": autograd_greeks}
+
+def bs_greeks(option_type, spot, strike, time, iv, r, d, method="analytic"):
+    if method not in GREEKS_METHODS:
+        raise Exception(f"<Black Scholes> Unknown greeks method - {method} - Options: {list(GREEKS_METHODS)}")
+    if method == "analytic":
+        spot, strike, time, iv, r, d = (x.detach() for x in (spot, strike, time, iv, r, d))
+    return GREEKS_METHODS[method](option_type, spot, strike, time, iv, r, d)
+
+def black_scholes_batch(option_type, spot, strike, time, implied_volatility, risk_free_rate, dividend_rate,
+                        greeks=True, greeks_method="analytic"):
+    as_tensor = lambda x: torch.tensor(np.asarray(x, dtype=np.float64)) # copies: torch can't wrap read-only views
+    inputs = [as_tensor(x) for x in (spot, strike, time, implied_volatility, risk_free_rate, dividend_rate)]
+
+    with torch.no_grad():
+        results = {"npv": bs_npv(option_type, *inputs).numpy()}
+    if greeks:
+        results.update({k: v.numpy() for k, v in bs_greeks(option_type, *inputs, method=greeks_method).items()})
+    return results
 
 class BlackScholes(Model):
-    def __init__(self, params):
+    def __init__(self, params, greeks_method="analytic"):
         super().__init__(params, with_tensors=True, name="Black Scholes")
+        self._greeks_method = greeks_method
 
-        self._cdf = Normal(0,1).cdf
-        self._pdf = lambda x: Normal(0,1).log_prob(x).exp()
+    @classmethod
+    def price_chain(cls, contracts: pd.DataFrame, spot, maturity=None, risk_free_rate=0.0, dividend_rate=0.0,
+                    greeks=True, greeks_method="analytic"):
+        inputs = chain_inputs(contracts, spot, maturity, risk_free_rate, dividend_rate)
+        return attach_columns(contracts, black_scholes_batch(**inputs, greeks=greeks, greeks_method=greeks_method))
 
     @property
     def npv(self):
-        d_1 = (1 / (self._iv * torch.sqrt(self._time))) * (torch.log(self._spot / self._strike) + (self._r + (torch.square(self._iv) / 2)) * self._time)
-        d_2 = d_1 - self._iv * torch.sqrt(self._time)
-        
-        if self._option_type == "P":
-            P = self._cdf(d_1) * self._spot - self._cdf(d_2) * self._strike * torch.exp(-self._r * self._time)
-            return P
-            
-        elif self._option_type == "C":
-            C = self._cdf(-d_2) * self._strike * torch.exp(-self._r * self._time) - self._cdf(-d_1) * self._spot
-            return C
+        inputs = (self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d)
+        return self._cached("npv", lambda: bs_npv(*inputs))
 
     @property
     def greeks(self):
-        npv = self.npv
-        npv.backward()
-        return {
-            "delta": self._spot.grad,
-            "rho" : self._r.grad,
-            "vega" : self._iv.grad,
-            "theta" : self._time.grad,
-        }
+        inputs = (self._option_type, self._spot, self._strike, self._time, self._iv, self._r, self._d)
+        return self._cached("greeks", lambda: bs_greeks(*inputs, method=self._greeks_method))
 
     def st_visualize(self):
         st.success(str(self))
@@ -0,0 +1,95 @@
+# Batched implied volatility: safeguarded Newton on whole arrays of marks at once
+import math
+import numpy as np
+import torch
+
+from models.black_scholes import bs_npv, analytic_greeks
+from models.lattice import lattice_npv
+
+IV_MODELS = ("Black Scholes", "Binomial Tree")
+
+def _bs_price_vega(option_type, spot, strike, time, iv, r, d):
+    inputs = [torch.tensor(np.asarray(x, dtype=np.float64)) for x in (spot, strike, time, iv, r, d)]
+    with torch.no_grad():
+        return bs_npv(option_type, *inputs).numpy(), analytic_greeks(option_type, *inputs)["vega"].numpy()
+
+def _lattice_price_vega(option_type, spot, strike, time, iv, r, d, steps, method, american, bump=1e-4):
+    # one sweep prices the rows and their vol-bumped copies together
+    stack = lambda x: np.tile(x, 2)
+    prices = lattice_npv(stack(option_type), stack(spot), stack(strike), stack(time), np.concatenate([iv, iv + bump]),
+                         stack(r), stack(d), steps=steps, method=method, american=american)
+    price, bumped = prices.reshape(2, -1)
+    return price, (bumped - price) / bump
+
+def initial_guess(marks, option_type, spot, strike, time, r, d):
+    # Corrado-Miller on the parity-implied call price, Brenner-Subrahmanyam where it has no real root
+    forward_spot, discounted_strike = spot * np.exp(-d * time), strike * np.exp(-r * time)
+    call = np.where(option_type == "C", marks, marks + forward_spot - discounted_strike)
+
+    moneyness = (forward_spot - discounted_strike) / 2
+    radicand = np.square(call - moneyness) - np.square(forward_spot - discounted_strike) / math.pi
+    corrado_miller = math.sqrt(2 * math.pi) / (np.sqrt(time) * (forward_spot + discounted_strike)) \
+        * (call - moneyness + np.sqrt(np.maximum(radicand, 0)))
+    brenner = math.sqrt(2 * math.pi) * call / (forward_spot * np.sqrt(time))
+    return np.where(radicand >= 0, corrado_miller, brenner)
+
+def implied_volatility(marks, option_type, spot, strike, time, r, d, model="Black Scholes", tol=1e-6, max_iter=100,
+                       lower=1e-4, upper=5.0, steps=100, method="crr", american=True, min_vega=1e-2):
+    if model not in IV_MODELS:
+        raise Exception(f"<Implied Volatility> Unknown model - {model} - Options: {list(IV_MODELS)}")
+
+    n = max(np.size(x) for x in (marks, option_type, spot, strike, time, r, d))
+    marks, spot, strike, time, r, d = (np.broadcast_to(np.asarray(x, dtype=np.float64), (n,)).copy()
+                                       for x in (marks, spot, strike, time, r, d))
+    option_type = np.broadcast_to(np.asarray(option_type), (n,))
+
+    lo, hi = np.full(n, lower), np.full(n, upper)
+    if model == "Black Scholes":
+        price_vega = lambda idx, iv: _bs_price_vega(option_type[idx], spot[idx], strike[idx], time[idx], iv, r[idx], d[idx])
+    else:
+        price_vega = lambda idx, iv: _lattice_price_vega(option_type[idx], spot[idx], strike[idx], time[idx], iv, r[idx],
+                                                         d[idx], steps, method, american)
+        # below |r - d| * sqrt(dt) the tree's risk-neutral probabilities leave [0, 1]
+        lo = np.maximum(lo, 2 * np.abs(r - d) * np.sqrt(time / steps))
+
+    # marks outside the prices at the bracket ends have no implied volatility; neither does a mark at the
+    # floor-vol price (e.g. an american put at intrinsic), which fits every vol up to where the price starts to rise
+    everything = np.arange(n)
+    low_price, _ = price_vega(everything, lo.copy())
+    high_price, _ = price_vega(everything, hi.copy())
+    solvable = np.isfinite(marks) & (marks > low_price + tol) & (marks <= high_price + tol)
+
+    iv = np.clip(np.nan_to_num(initial_guess(marks, option_type, spot, strike, time, r, d), nan=0.2), lo, hi)
+    converged = np.zeros(n, dtype=bool)
+    iterations = np.zeros(n, dtype=np.int64)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(solvable & ~converged)
+        if len(idx) == 0:
+            break
+        price, vega = price_vega(idx, iv[idx])
+        diff = price - marks[idx]
+        iterations[idx] += 1
+
+        done = np.abs(diff) < tol
+        # where the price barely moves with vol (deep in the money, early exercise) any vol in a wide band
+        # matches the mark; those rows have no identifiable implied volatility
+        flat = done & ~(vega >= min_vega)
+        solvable[idx[flat]] = False
+        converged[idx[done & ~flat]] = True
+
+        # keep a bracket so a bad Newton step (tiny vega, far wings) falls back to bisection
+        above = diff > 0
+        hi[idx] = np.where(above, iv[idx], hi[idx])
+        lo[idx] = np.where(above, lo[idx], iv[idx])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = iv[idx] - diff / vega
+        inside = np.isfinite(newton) & (newton > lo[idx]) & (newton < hi[idx])
+        step = np.where(inside, newton, (lo[idx] + hi[idx]) / 2)
+        iv[idx] = np.where(done, iv[idx], step)
+
+    return {
+        "implied_volatility": np.where(converged, iv, np.nan),
+        "converged": converged,
+        "iterations": iterations,
+    }
@@ -0,0 +1,204 @@
+# Vectorized recombining lattices (binomial & trinomial) priced by backward induction on NumPy arrays
+import numpy as np
+
+LATTICE_METHODS = ("crr", "jr", "lr", "trinomial")
+
+def _column(x, n):
+    return np.broadcast_to(np.asarray(x, dtype=np.float64), (n,)).reshape(n, 1)
+
+def _peizer_pratt(z, n):
+    # Peizer-Pratt method 2 inversion used by Leisen-Reimer
+    return 0.5 + np.sign(z) * np.sqrt(0.25 - 0.25 * np.exp(-np.square(z / (n + 1 / 3 + 0.1 / (n + 1))) * (n + 1 / 6)))
+
+def lattice_steps(method, steps):
+    # Leisen-Reimer is only defined for an odd number of steps
+    return steps + 1 if method == "lr" and steps % 2 == 0 else steps
+
+def _check_probabilities(method, steps, *probabilities):
+    # coarse trees (large dt against a small vol) push the risk-neutral probabilities out of [0, 1]
+    for p in probabilities:
+        invalid = ~((p >= 0) & (p <= 1))
+        if np.any(invalid):
+            bad_steps = np.unique(np.broadcast_to(steps, invalid.shape)[invalid]).astype(int).tolist()
+            raise Exception(f"<Lattice> Negative probability - {method} tree with {bad_steps} steps - "
+                            f"use more steps or a higher volatility")
+
+def _binomial_moves(method, spot, strike, time, iv, r, d, steps):
+    dt = time / steps
+    growth = np.exp((r - d) * dt)
+
+    if method == "crr":
+        up = np.exp(iv * np.sqrt(dt))
+        down = 1 / up
+        p = (growth - down) / (up - down)
+    elif method == "jr":
+        drift = (r - d - np.square(iv) / 2) * dt
+        up, down = np.exp(drift + iv * np.sqrt(dt)), np.exp(drift - iv * np.sqrt(dt))
+        p = np.full_like(up, 0.5)
+    else:
+        d_1 = (np.log(spot / strike) + (r - d + np.square(iv) / 2) * time) / (iv * np.sqrt(time))
+        d_2 = d_1 - iv * np.sqrt(time)
+        p, p_bar = _peizer_pratt(d_2, steps), _peizer_pratt(d_1, steps)
+        up = growth * p_bar / p
+        down = (growth - p * up) / (1 - p)
+
+    return up, down, p
+
+def _trinomial_moves(iv, r, d, steps, time):
+    dt = time / steps
+    half_up, half_down = np.exp(iv * np.sqrt(dt / 2)), np.exp(-iv * np.sqrt(dt / 2))
+    half_growth = np.exp((r - d) * dt / 2)
+
+    p_up = np.square((half_growth - half_down) / (half_up - half_down))
+    p_down = np.square((half_up - half_growth) / (half_up - half_down))
+    return np.exp(iv * np.sqrt(2 * dt)), p_up, p_down
+
+def _exercise_value(is_call, spot, strike):
+    return np.maximum(np.where(is_call, spot - strike, strike - spot), 0.0)
+
+def _induct(option_type, spot, strike, time, iv, r, d, steps, method, american):
+    if method not in LATTICE_METHODS:
+        raise Exception(f"<Lattice> Unknown method - {method} - Options: {list(LATTICE_METHODS)}")
+
+    option_type = np.atleast_1d(np.asarray(option_type))
+    n = max(np.size(x) for x in (option_type, spot, strike, time, iv, r, d))
+    is_call = np.broadcast_to(option_type == "C", (n,)).reshape(n, 1)
+    spot, strike, time, iv, r, d = (_column(x, n) for x in (spot, strike, time, iv, r, d))
+
+    steps = lattice_steps(method, steps)
+    discount = np.exp(-r * time / steps)
+
+    if method == "trinomial":
+        up, p_up, p_down = _trinomial_moves(iv, r, d, steps, time)
+        p_mid = 1 - p_up - p_down
+        _check_probabilities(method, steps, p_up, p_down, p_mid)
+        log_spot, log_up = np.log(spot), np.log(up)
+        nodes = lambda i: np.exp(log_spot + np.arange(-i, i + 1) * log_up)
+        roll = lambda v: discount * (p_down * v[:, :-2] + p_mid * v[:, 1:-1] + p_up * v[:, 2:])
+    else:
+        up, down, p = _binomial_moves(method, spot, strike, time, iv, r, d, steps)
+        _check_probabilities(method, steps, p)
+        log_spot, log_up, log_down = np.log(spot), np.log(up), np.log(down)
+        nodes = lambda i: np.exp(log_spot + np.arange(i + 1) * log_up + np.arange(i, -1, -1) * log_down)
+        roll = lambda v: discount * (p * v[:, 1:] + (1 - p) * v[:, :-1])
+
+    # the first two time slices are kept so greeks can be read off the same induction
+    early = {}
+    values = _exercise_value(is_call, nodes(steps), strike)
+    for i in range(steps - 1, -1, -1):
+        values = roll(values)
+        if american:
+            values = np.maximum(values, _exercise_value(is_call, nodes(i), strike))
+        if 0 < i <= 2:
+            early[i] = (nodes(i), values)
+
+    return values[:, 0], early, time[:, 0] / steps
+
+def lattice_npv(option_type, spot, strike, time, iv, r, d, steps=100, method="crr", american=False):
+    return _induct(option_type, spot, strike, time, iv, r, d, steps, method, american)[0]
+
+def lattice_greeks(option_type, spot, strike, time, iv, r, d, steps=100, method="crr", american=False,
+                   vol_bump=0.01, rate_bump=0.0001):
+    n = max(np.size(x) for x in (option_type, spot, strike, time, iv, r, d))
+    option_type, spot, strike, time, iv, r, d = (np.broadcast_to(np.asarray(x), (n,))
+                                                 for x in (option_type, spot, strike, time, iv, r, d))
+
+    # vega & rho come from central bumps priced in the same sweep as the base rows
+    stack = lambda *xs: np.concatenate(xs)
+    npv, early, dt = _induct(np.tile(option_type, 5), np.tile(spot, 5), np.tile(strike, 5), np.tile(time, 5),
+                             stack(iv, iv + vol_bump, iv - vol_bump, iv, iv),
+                             stack(r, r, r, r + rate_bump, r - rate_bump),
+                             np.tile(d, 5), steps, method, american)
+    base, vol_up, vol_down, rate_up, rate_down = npv.reshape(5, n)
+    dt = dt[:n]
+
+    s_1, v_1 = (x[:n] for x in early[1])
+    s_2, v_2 = (x[:n] for x in early[1 if method == "trinomial" else 2])
+    s_down, s_mid, s_up = s_2.T
+    v_down, v_mid, v_up = v_2.T
+    horizon = dt if method == "trinomial" else 2 * dt
+
+    delta = (v_1[:, -1] - v_1[:, 0]) / (s_1[:, -1] - s_1[:, 0])
+    delta_up, delta_down = (v_up - v_mid) / (s_up - s_mid), (v_mid - v_down) / (s_mid - s_down)
+    gamma = (delta_up - delta_down) / ((s_up - s_down) / 2)
+
+    # the middle node only sits on the spot for CRR & trinomial; shift it back along delta/gamma otherwise
+    shift = s_mid - spot
+    v_mid = v_mid - delta * shift - gamma * np.square(shift) / 2
+
+    return {
+        "npv": base,
+        "delta": delta,
+        "gamma": gamma,
+        "vega": (vol_up - vol_down) / (2 * vol_bump),
+        "theta": -(v_mid - base) / horizon, # dV/dT, matching the Black-Scholes convention
+        "rho": (rate_up - rate_down) / (2 * rate_bump),
+    }
+
+EXTRAPOLATIONS = (None, "odd_even", "richardson")
+
+# crr/jr errors oscillate between odd & even step counts (averaging helps, extrapolating doesn't);
+# lr only takes odd counts and converges smoothly as 1/N^2, which is what richardson assumes
+METHOD_EXTRAPOLATIONS = {
+    "crr": (None, "odd_even"),
+    "jr": (None, "odd_even"),
+    "lr": (None, "richardson"),
+    "trinomial": (None,),
+}
+
+def _european_binomial_sweep(option_type, spot, strike, time, iv, r, d, steps, method):
+    # each row is one step count; the European price is the discounted payoff against the
+    # binomial distribution of up-moves, so every step count is priced in one 2-D pass
+    n = np.array([lattice_steps(method, s) for s in steps], dtype=np.float64).reshape(-1, 1)
+    j = np.arange(int(n.max()) + 1, dtype=np.float64).reshape(1, -1)
+    valid = j <= n
+
+    up, down, p = _binomial_moves(method, spot, strike, time, iv, r, d, n)
+    _check_probabilities(method, n, p)
+    log_choose = np.cumsum(np.where((j > 0) & valid, np.log(np.maximum(n - j + 1, 1) / np.maximum(j, 1)), 0.0), axis=1)
+    log_pmf = log_choose + j * np.log(p) + (n - j) * np.log(1 - p)
+
+    terminal = spot * np.exp(j * np.log(up) + (n - j) * np.log(down))
+    payoff = _exercise_value(option_type == "C", terminal, strike)
+    expectation = np.where(valid, np.exp(log_pmf) * payoff, 0.0).sum(axis=1)
+
+    return np.exp(-r * time) * expectation
+
+def _sweep(option_type, spot, strike, time, iv, r, d, steps, method, american):
+    if american or method == "trinomial":
+        return np.array([lattice_npv(option_type, spot, strike, time, iv, r, d, steps=s, method=method, american=american)[0]
+                         for s in steps])
+    return _european_binomial_sweep(option_type, spot, strike, time, iv, r, d, steps, method)
+
+def convergence_sweep(option_type, spot, strike, time, iv, r, d, steps=range(2, 200), method="crr", american=False,
+                      extrapolation=None):
+    if extrapolation not in EXTRAPOLATIONS:
+        raise Exception(f"<Lattice> Unknown extrapolation - {extrapolation} - Options: {list(EXTRAPOLATIONS)}")
+    if method not in LATTICE_METHODS:
+        raise Exception(f"<Lattice> Unknown method - {method} - Options: {list(LATTICE_METHODS)}")
+    if extrapolation not in METHOD_EXTRAPOLATIONS[method]:
+        raise Exception(f"<Lattice> {extrapolation} extrapolation doesn't fit {method} trees - "
+                        f"Options: {list(METHOD_EXTRAPOLATIONS[method])}")
+
+    steps = list(steps)
+    if extrapolation == "odd_even":
+        paired = [s + 1 for s in steps]
+    elif extrapolation == "richardson":
+        paired = [2 * s for s in steps]
+    else:
+        paired = []
+
+    needed = sorted(set(steps) | set(paired))
+    priced = dict(zip(needed, _sweep(option_type, *(float(x) for x in (spot, strike, time, iv, r, d)),
+                                     needed, method, american)))
+    base = np.array([priced[s] for s in steps])
+
+    if extrapolation == "odd_even":
+        return (base + np.array([priced[s] for s in paired])) / 2
+    if extrapolation == "richardson":
+        # the error is c / N^2, so weighting by the squared (effective) step counts cancels it;
+        # (4 * V(2N) - V(N)) / 3 when the counts are exactly N & 2N
+        coarse = np.array([lattice_steps(method, s) for s in steps], dtype=np.float64) ** 2
+        fine = np.array([lattice_steps(method, s) for s in paired], dtype=np.float64) ** 2
+        return (fine * np.array([priced[s] for s in paired]) - coarse * base) / (fine - coarse)
+    return base
@@ -1,15 +1,154 @@
+import time
 import torch
 import pandas as pd
+import tensorflow as tf
 import streamlit as st
 import matplotlib.pyplot as plt
+from torch.distributions import Normal
+from torch.quasirandom import SobolEngine
 
 from models.abstract import Model
 
+VARIANCE_REDUCTIONS = ("antithetic", "control_variate", "moment_matching")
+PLOT_PATHS = 10_000 # terminal prices kept for the european histogram
+
+_cdf = Normal(0,1).cdf
+
+def _accumulate(stats, x, y):
+    # running sums (n, Σx, Σx², Σy, Σy², Σxy) are all the estimator & its standard error need
+    x, y = x.detach().double(), y.detach().double()
+    stats += torch.stack([torch.tensor(float(len(x)), dtype=torch.float64), x.sum(), (x * x).sum(),
+                          y.sum(), (y * y).sum(), (x * y).sum()])
+
+def _summarize(stats, control_mean=None):
+    n, sx, sxx, sy, syy, sxy = stats
+    var_x = (sxx - sx * sx / n) / (n - 1)
+    if control_mean is None:
+        return sx / n, torch.sqrt(var_x / n)
+
+    var_y = (syy - sy * sy / n) / (n - 1)
+    cov = (sxy - sx * sy / n) / (n - 1)
+    beta = torch.where(var_y > 0, cov / var_y, torch.zeros_like(cov)) # a constant control carries no information
+    estimate = sx / n - beta * (sy / n - control_mean)
+    return estimate, torch.sqrt(torch.clamp(var_x - beta * cov, min=0) / n)
+
+class PseudoRandomSampler:
+    replicates = 1
+    brownian_bridge = False
+
+    def __init__(self, seed=42):
+        self._seed = seed
+        self._generator = None
+
+    def spawn(self, replicate):
+        return self
+
+    def reset(self, dims):
+        # a private generator: concurrent pricings can't interleave each other's streams
+        self._generator = torch.Generator().manual_seed(self._seed)
+
+    def normals(self, rows, dims):
+        return torch.randn((rows, dims), generator=self._generator)
+
+
+class SobolSampler:
+    # low-discrepancy draws; the bridge puts the leading (best distributed) coordinates on the coarse path structure
+    replicates = 1
+
+    def __init__(self, seed=42, scramble=False, brownian_bridge=True):
+        self._seed = seed
+        self._scramble = scramble
+        self.brownian_bridge = brownian_bridge
+        self._engine = None
+
+    def spawn(self, replicate):
+        return self
+
+    def reset(self, dims):
+        self._engine = SobolEngine(dims, scramble=self._scramble, seed=self._seed)
+        if not self._scramble:
+            self._engine.fast_forward(1) # the unscrambled first point is the origin, i.e. -inf normals
+
+    def normals(self, rows, dims):
+        u = self._engine.draw(rows)
+        eps = torch.finfo(u.dtype).eps
+        return torch.special.ndtri(torch.clamp(u, eps, 1 - eps))
+
+
+class ScrambledSobolSampler(SobolSampler):
+    # randomized QMC: independent scrambles give an honest standard error from the spread of replicate estimates
+    def __init__(self, seed=42, replicates=8, brownian_bridge=True):
+        super().__init__(seed=seed, scramble=True, brownian_bridge=brownian_bridge)
+        self.replicates = replicates
+
+    def spawn(self, replicate):
+        return SobolSampler(seed=self._seed + replicate, scramble=True, brownian_bridge=self.brownian_bridge)
+
+
+SAMPLERS = {"pseudo": PseudoRandomSampler, "sobol": SobolSampler, "scrambled_sobol": ScrambledSobolSampler}
+
+def _bridge_schedule(n):
+    # (point, left neighbour, right neighbour) in construction order; -1 is W(0) = 0
+    schedule, intervals = [(n - 1, -1, None)], [(-1, n - 1)]
+    while intervals:
+        left, right = intervals.pop(0)
+        if right - left < 2:
+            continue
+        mid = (left + right) // 2
+        schedule.append((mid, left, right))
+        intervals += [(left, mid), (mid, right)]
+    return schedule
+
+def brownian_bridge(z, dt):
+    # maps [paths, steps] standard normals to W(t_1..t_n) on the grid t_k = k * dt
+    w = [None] * z.shape[1]
+    time = lambda k: (k + 1) * dt
+    for col, (k, left, right) in enumerate(_bridge_schedule(z.shape[1])):
+        if right is None:
+            w[k] = (time(k) ** 0.5) * z[:, col]
+            continue
+        t_l, t_r = (time(left) if left >= 0 else 0.0), time(right)
+        w_l = w[left] if left >= 0 else 0.0
+        weight = (time(k) - t_l) / (t_r - t_l)
+        std = ((time(k) - t_l) * (t_r - time(k)) / (t_r - t_l)) ** 0.5
+        w[k] = w_l + weight * (w[right] - w_l) + std * z[:, col]
+    return torch.stack(w, 1)
+
 class MonteCarlo(Model):
-    def __init__(self, params, region):
+    _live_tensors = 5 # float32 tensors alive per simulated path step (draws, increments, cumsum, dW, prices)
+
+    def __init__(self, params, region, scenarios=None, max_memory_mb=None, variance_reduction=None, sampler="pseudo",
+                 target_stderr=None, target_rel_error=None, time_budget=None, batch_size=65_536):
         super().__init__(params, with_tensors=True, name="Monte Carlo")
         self._region = region
-        self._plot = None
+        self._sample = None
+        self._scenarios = scenarios if scenarios else (1000000 if region == "eu" else 100_000)
+        self._max_memory_mb = max_memory_mb
+
+        if isinstance(variance_reduction, str):
+            variance_reduction = (variance_reduction,)
+        self._variance_reduction = tuple(variance_reduction or ())
+        unknown = [mode for mode in self._variance_reduction if mode not in VARIANCE_REDUCTIONS]
+        if unknown:
+            raise Exception(f"<Monte Carlo> Unknown variance reduction - {unknown} - Options: {list(VARIANCE_REDUCTIONS)}")
+
+        if isinstance(sampler, str):
+            if sampler not in SAMPLERS:
+                raise Exception(f"<Monte Carlo> Unknown sampler - {sampler} - Options: {list(SAMPLERS)}")
+            sampler = SAMPLERS[sampler]()
+        self._sampler = sampler
+
+        # adaptive mode: scenarios becomes a cap and simulation stops once a target (or the time budget) is hit
+        self._target_stderr = target_stderr
+        self._target_rel_error = target_rel_error
+        self._time_budget = time_budget
+        self._batch_size = batch_size
+        self._adaptive = any(x is not None for x in (target_stderr, target_rel_error, time_budget))
+        if self._adaptive and self._sampler.replicates > 1:
+            raise Exception("<Monte Carlo> Adaptive stopping needs a single-replicate sampler")
+
+        if self._antithetic:
+            self._scenarios -= self._scenarios % 2
     
     def _euo_plot(self, prices):
         data = prices.detach().numpy()
@@ -33,42 +172,181 @@ class MonteCarlo(Model):
         return fig
 
     @property
-    def npv(self):
-        torch.manual_seed(42)
-        scenarios = 1000000 if self._region == "eu" else 100_000
+    def _n_steps(self):
+        return 1 if self._region == "eu" else int(self._time * 252)
+
+    @property
+    def _antithetic(self):
+        return "antithetic" in self._variance_reduction
+
+    @property
+    def _control_variate(self):
+        return "control_variate" in self._variance_reduction
 
+    def _chunks(self, scenarios, adaptive=False):
+        # chunks are a multiple of 16 draws so torch.randn consumes the seeded stream exactly as one dense draw
+        block = 32 if self._antithetic else 16
+        rows = scenarios
+        if self._max_memory_mb is not None:
+            path_bytes = self._n_steps * 4 * self._live_tensors
+            rows = max(block, int(self._max_memory_mb * 2 ** 20 // path_bytes) // block * block)
+        if adaptive:
+            # batch_size counts normal draws, not paths: long asian paths get fewer rows per stopping check
+            rows = min(rows, max(block, self._batch_size // self._n_steps // block * block))
+
+        for start in range(0, scenarios, rows):
+            yield min(rows, scenarios - start)
+
+    def _draws(self, sampler, scenarios):
+        if self._antithetic:
+            z = sampler.normals(scenarios // 2, self._n_steps)
+            z = torch.cat([z, -z])
+        else:
+            z = sampler.normals(scenarios, self._n_steps)
+
+        if "moment_matching" in self._variance_reduction:
+            z = (z - torch.mean(z, 0)) / torch.std(z, 0)
+        return z
+
+    def _simulate(self, sampler, scenarios):
+        z = self._draws(sampler, scenarios)
         if self._region == "eu":
-            w_t = torch.sqrt(self._time) * torch.randn(size=(scenarios,)) #Brownian Motion
+            w_t = torch.sqrt(self._time) * z[:, 0] #Brownian Motion
+            drift_time = self._time
         else:
             dt = torch.tensor(1 / 252)
-            w_t = torch.cumsum(torch.sqrt(dt) * torch.randn([scenarios, int(self._time * 252)]), 1)
+            w_t = brownian_bridge(z, 1 / 252) if sampler.brownian_bridge else torch.cumsum(torch.sqrt(dt) * z, 1)
+            drift_time = dt * torch.arange(1, self._n_steps + 1)
 
         dW = self._iv * w_t
-        prices = self._spot * torch.exp((self._r - self._d - self._iv * self._iv / 2) * self._time + dW)
+        return self._spot * torch.exp((self._r - self._d - self._iv * self._iv / 2) * drift_time + dW)
 
+    def _payoff(self, prices):
+        underlying = prices if self._region == "eu" else torch.mean(prices, axis=1)
+        if self._option_type == "P":
+            return torch.clamp(self._strike - underlying, min=0)
+        return torch.clamp(underlying - self._strike, min=0)
+
+    def _control(self, prices):
+        # EU: the terminal price itself; AS: the geometric-average option on the same path
         if self._region == "eu":
-            self._plot = self._euo_plot(prices)
-            if self._option_type == "P":
-                payoff = torch.max(self._strike - prices, torch.zeros(size=(scenarios,)))
-            else:
-                payoff = torch.max(prices - self._strike, torch.zeros(size=(scenarios,)))
-        else:
-            self._plot = self._aso_plot(prices)
-            if self._option_type == "P":
-                payoff = torch.max(self._strike - torch.mean(prices, axis=1), torch.zeros(scenarios))
-            else:
-                payoff = torch.max(torch.mean(prices, axis=1) - self._strike, torch.zeros(scenarios))
+            return prices
+        geometric = torch.exp(torch.mean(torch.log(prices), axis=1))
+        if self._option_type == "P":
+            return torch.clamp(self._strike - geometric, min=0)
+        return torch.clamp(geometric - self._strike, min=0)
+
+    def _control_mean(self):
+        # closed-form expectation of the discounted control under the simulated dynamics
+        spot, strike, time, iv, r, d = (x.detach().double() for x in (self._spot, self._strike, self._time, self._iv, self._r, self._d))
+        if self._region == "eu":
+            return spot * torch.exp(-d * time)
+
+        n, dt = self._n_steps, 1 / 252
+        mu = torch.log(spot) + (r - d - iv * iv / 2) * dt * (n + 1) / 2
+        var = iv * iv * dt * (n + 1) * (2 * n + 1) / (6 * n)
+        d_1 = (mu - torch.log(strike) + var) / torch.sqrt(var)
+        d_2 = d_1 - torch.sqrt(var)
+        forward = torch.exp(mu + var / 2)
+        if self._option_type == "P":
+            return torch.exp(-r * time) * (strike * _cdf(-d_2) - forward * _cdf(-d_1))
+        return torch.exp(-r * time) * (forward * _cdf(d_1) - strike * _cdf(d_2))
+
+    def _paired(self, x):
+        # antithetic pairs are one sample, otherwise the standard error is understated
+        if not self._antithetic:
+            return x
+        half = len(x) // 2
+        return (x[:half] + x[half:]) / 2
+
+    def _converged(self, stats, control_mean, started):
+        if stats[0] < 2:
+            return False
+        estimate, stderr = _summarize(stats, control_mean)
+        if self._target_stderr is not None and stderr <= self._target_stderr:
+            return True
+        if self._target_rel_error is not None and stderr <= self._target_rel_error * abs(estimate):
+            return True
+        return self._time_budget is not None and time.perf_counter() - started >= self._time_budget
+
+    def _replicate(self, sampler, scenarios, with_grad, total, adaptive=False):
+        # walks the scenarios chunk by chunk; only running sums outlive a chunk
+        started = time.perf_counter()
+        sampler.reset(self._n_steps)
+        stats = torch.zeros(6, dtype=torch.float64)
+        control_mean = self._control_mean() if self._control_variate else None
+        used = 0
+
+        for rows in self._chunks(scenarios, adaptive):
+            with torch.set_grad_enabled(with_grad):
+                prices = self._simulate(sampler, rows)
+                discount = torch.exp(-self._r * self._time)
+                payoff = self._payoff(prices) * discount
+
+            if self._sample is None:
+                self._sample = self._plot_sample(prices)
+            if with_grad:
+                (torch.sum(payoff) / total).backward()
+
+            control = self._control(prices.detach()) * discount.detach() if self._control_variate else payoff
+            _accumulate(stats, self._paired(payoff), self._paired(control))
+            del prices, payoff, control
+
+            used += rows
+            if adaptive and self._converged(stats, control_mean, started):
+                break
+
+        estimate, stderr = _summarize(stats, control_mean)
+        return estimate, stderr, used
+
+    def _plot_sample(self, prices):
+        # a bounded copy for the lazily drawn plot, so the memoized estimate doesn't pin a whole chunk
+        return prices[:PLOT_PATHS if self._region == "eu" else 1].detach().clone()
+
+    def _redraw_sample(self):
+        sampler = self._sampler.spawn(0)
+        sampler.reset(self._n_steps)
+        with torch.no_grad():
+            return self._plot_sample(self._simulate(sampler, min(PLOT_PATHS, self._per_replicate)))
 
-        return torch.mean(payoff) * torch.exp(-self._r*self._time)
-    
-    @property
-    def plot(self):
-        return self._plot
-    
     @property
-    def greeks(self):
-        ov = self.npv
-        ov.backward()
+    def _per_replicate(self):
+        per_replicate = self._scenarios // self._sampler.replicates
+        return per_replicate - per_replicate % 2 if self._antithetic else per_replicate
+
+    def _estimate(self):
+        replicates, per_replicate = self._sampler.replicates, self._per_replicate
+        self._sample = None
+        results = [self._replicate(self._sampler.spawn(k), per_replicate, False, per_replicate * replicates,
+                                   adaptive=self._adaptive)
+                   for k in range(replicates)]
+        estimates = torch.stack([estimate for estimate, _, _ in results])
+
+        if replicates == 1:
+            stderr = results[0][1] # the iid formula; conservative for unrandomized QMC
+        else:
+            stderr = torch.std(estimates) / replicates ** 0.5
+
+        return {
+            "npv": torch.mean(estimates).float(),
+            "stderr": float(stderr),
+            "scenarios_used": sum(used for _, _, used in results),
+            "sample": self._sample,
+        }
+
+    def _greeks(self):
+        for leaf in (self._spot, self._r, self._iv, self._time):
+            leaf.grad = None
+
+        if self._adaptive:
+            # greeks replay exactly the paths the adaptive NPV settled on
+            used = self.scenarios_used
+            self._replicate(self._sampler.spawn(0), used, True, used)
+        else:
+            replicates, per_replicate = self._sampler.replicates, self._per_replicate
+            for k in range(replicates):
+                self._replicate(self._sampler.spawn(k), per_replicate, True, per_replicate * replicates)
+
         return {
             "delta": self._spot.grad,
             "rho": self._r.grad,
@@ -76,8 +354,37 @@ class MonteCarlo(Model):
             "theta": self._time.grad,
         }
 
+    @property
+    def npv(self):
+        return self._cached("estimate", self._estimate)["npv"]
+
+    @property
+    def diagnostics(self):
+        estimate = self._cached("estimate", self._estimate)
+        return {"stderr": estimate["stderr"], "scenarios_used": estimate["scenarios_used"]}
+
+    @property
+    def stderr(self):
+        return self.diagnostics["stderr"]
+
+    @property
+    def scenarios_used(self):
+        return self.diagnostics["scenarios_used"]
+
+    @property
+    def plot(self):
+        sample = self._cached("estimate", self._estimate).get("sample")
+        if sample is None: # estimates restored from the pricing cache carry no paths
+            sample = self._redraw_sample()
+        return self._cached("plot", lambda: self._euo_plot(sample) if self._region == "eu" else self._aso_plot(sample))
+
+    @property
+    def greeks(self):
+        return self._cached("greeks", self._greeks)
+
     def st_visualize(self):
         st.success(str(self))
+        st.caption(f"Standard Error: {self.stderr:.6f} ({self.scenarios_used} Scenarios)")
         st.divider()
         st.subheader("Calculated Greeks")
         greeks = self.greeks
@@ -89,12 +396,12 @@ class MonteCarlo(Model):
         st.divider()
 
 class EUMonteCarlo(MonteCarlo):
-    def __init__(self, params):
-        super().__init__(params, "eu")
+    def __init__(self, params, **kwargs):
+        super().__init__(params, "eu", **kwargs)
 
 class ASMonteCarlo(MonteCarlo):
-    def __init__(self, params):
-        super().__init__(params, "as")
+    def __init__(self, params, **kwargs):
+        super().__init__(params, "as", **kwargs)
 
 
 def _simulate_ep(policy, env, time_step, base_return=0.0):
@@ -106,13 +413,12 @@ def _simulate_ep(policy, env, time_step, base_return=0.0):
     return base_return
 
 def _simulate_eps(policy, env, eps, st_display=False):
-    step = env.reset()
     total = 0
 
     if st_display:
         bar = st.progress(0.0, text=f"Simulating Episodes... (0/{eps})")
     for ep in range(eps):
-        total += _simulate_ep(policy, env, step)
+        total += _simulate_ep(policy, env, env.reset()) # every episode starts from its own reset
         if st_display:
             bar.progress(float(ep / eps), text=f"Simulating Episodes... ({ep}/{eps})")
     
@@ -124,3 +430,21 @@ def _simulate_eps(policy, env, eps, st_display=False):
 def dqn_sim(policy, env, eps=10, base_return=0.0, st_display=False):
     avg_return = (base_return + _simulate_eps(policy, env, eps, st_display=st_display)) / eps
     return avg_return.numpy()[0] #tf dqn agent method
+
+@tf.function
+def _rollout(policy, env):
+    # every path in the batched env plays one episode; the q-network sees the whole batch each day
+    time_step = env.reset()
+    returns = tf.zeros_like(time_step.reward)
+    alive = tf.ones_like(time_step.reward, dtype=tf.bool)
+    while tf.reduce_any(alive):
+        time_step = env.step(policy.action(time_step).action)
+        returns += tf.where(alive, time_step.reward, tf.zeros_like(time_step.reward))
+        alive = alive & ~time_step.is_last() # paths auto-reset after their last step, so mask them out
+    return returns
+
+def dqn_batch_sim(policy, env):
+    # (average return, standard error) over env.batch_size independent episodes
+    returns = _rollout(policy, env).numpy().astype("float64")
+    stderr = returns.std(ddof=1) / len(returns) ** 0.5 if len(returns) > 1 else float("nan")
+    return float(returns.mean()), float(stderr)
@@ -0,0 +1,76 @@
+# The option-exercise MDP as a native TFEnvironment: state lives in tf.Variables and
+# every step is a graph op, so collection/evaluation loops compile end to end
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.environments import tf_environment
+from tf_agents.specs import tensor_spec
+from tf_agents.trajectories import time_step as ts
+
+from models.openai_env import OptionEnv
+
+class TFOptionEnv(tf_environment.TFEnvironment):
+    def __init__(self, params, batch_size: int = 32, seed=None):
+        option = OptionEnv(params)
+        observation_spec = tensor_spec.BoundedTensorSpec((2,), tf.float32, minimum=[0, 0], maximum=[np.inf, 1.0],
+                                                         name="observation")
+        action_spec = tensor_spec.BoundedTensorSpec((), tf.int64, minimum=0, maximum=1, name="action")
+        super().__init__(ts.time_step_spec(observation_spec), action_spec, batch_size)
+
+        self._spot = tf.constant(option.spot, tf.float32)
+        self._strike = tf.constant(option.strike, tf.float32)
+        self._r = tf.constant(option.risk_free_rate, tf.float32)
+        self._float_time = tf.constant(option.float_time, tf.float32)
+        self._n_days = tf.constant(option.n_days, tf.float32)
+
+        dt = option.float_time / option.n_days
+        self._drift = tf.constant((option.risk_free_rate - 0.5 * option.implied_volatility ** 2) * dt, tf.float32)
+        self._vol = tf.constant(option.implied_volatility * np.sqrt(dt), tf.float32)
+
+        self._rng = tf.random.Generator.from_non_deterministic_state() if seed is None else tf.random.Generator.from_seed(seed)
+        self._s_new = tf.Variable(tf.fill([batch_size], self._spot), trainable=False)
+        self._day_step = tf.Variable(tf.zeros([batch_size], tf.float32), trainable=False)
+        self._step_type = tf.Variable(tf.fill([batch_size], ts.StepType.FIRST), trainable=False)
+        self._reward = tf.Variable(tf.zeros([batch_size], tf.float32), trainable=False)
+        self._discount = tf.Variable(tf.ones([batch_size], tf.float32), trainable=False)
+
+    def _current_time_step(self):
+        tao = 1.0 - self._day_step / self._n_days
+        observation = tf.stack([self._s_new, tao], axis=1)
+        return ts.TimeStep(step_type=tf.identity(self._step_type), reward=tf.identity(self._reward),
+                           discount=tf.identity(self._discount), observation=observation)
+
+    def _reset(self):
+        self._s_new.assign(tf.fill([self.batch_size], self._spot))
+        self._day_step.assign(tf.zeros([self.batch_size], tf.float32))
+        self._step_type.assign(tf.fill([self.batch_size], ts.StepType.FIRST))
+        self._reward.assign(tf.zeros([self.batch_size], tf.float32))
+        self._discount.assign(tf.ones([self.batch_size], tf.float32))
+        return self._current_time_step()
+
+    def _step(self, action):
+        action = tf.reshape(tf.cast(action, tf.int64), [self.batch_size])
+
+        # paths that finished on the previous step start a new episode and ignore their action
+        restarting = tf.equal(self._step_type, ts.StepType.LAST)
+        exercise = ~restarting & tf.equal(action, 1)
+        expiring = ~restarting & tf.equal(action, 0) & (self._day_step >= self._n_days)
+        holding = ~restarting & ~exercise & ~expiring
+
+        payoff = tf.maximum(self._strike - self._s_new, 0.0)
+        zeros = tf.zeros_like(payoff)
+        reward = tf.where(exercise, payoff * tf.exp(-self._r * self._float_time * (self._day_step / self._n_days)), zeros)
+        reward += tf.where(expiring, payoff * tf.exp(-self._r * self._float_time), zeros)
+
+        shocks = self._rng.normal([self.batch_size])
+        s_new = tf.where(holding, self._s_new * tf.exp(self._drift + self._vol * shocks), self._s_new)
+        day_step = self._day_step + tf.cast(holding, tf.float32)
+        self._s_new.assign(tf.where(restarting, tf.fill([self.batch_size], self._spot), s_new))
+        self._day_step.assign(tf.where(restarting, zeros, day_step))
+
+        done = exercise | expiring
+        step_type = tf.where(restarting, ts.StepType.FIRST, tf.where(done, ts.StepType.LAST, ts.StepType.MID))
+        self._step_type.assign(step_type)
+        self._reward.assign(reward)
+        self._discount.assign(tf.where(done, zeros, tf.ones_like(payoff)))
+        return self._current_time_step()
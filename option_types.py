@@ -1,3 +1,7 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
 from models.abstract import BaseOption
 
 from models.openai_env import OptionEnv
@@ -7,13 +11,84 @@ from models.binomial_tree import EUBinomialTree, USBinomialTree
 from models.black_scholes import BlackScholes
 from models.monte_carlo import EUMonteCarlo, ASMonteCarlo
 
+from utils.pricing_cache import PricingCache
+from utils.policy_registry import PolicyRegistry
+
 MODELS = {
     "eu": ["Black Scholes", "Binomial Tree", "Monte Carlo"],
     "us": ["Binomial Tree", "Deep Q-Network"],
     "as": ["Monte Carlo"]
 }
 
-class USOption(BaseOption):
+PRICING_CACHE = PricingCache(disk_path="data/pricing_cache.db")
+POLICY_REGISTRY = PolicyRegistry("data/policies")
+
+EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+def _price_remote(option_cls, kwargs, model):
+    return option_cls(**kwargs).priced(model)
+
+def _with_script_context(fn):
+    # streamlit widgets (e.g. the DQN progress bars) need the session's context on worker threads
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+        ctx = get_script_run_ctx()
+    except ImportError:
+        return fn
+
+    def run(*args):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args)
+    return run
+
+
+class ConcurrentPricing:
+    def as_completed(self, models=None, executor: str = "thread", max_workers=None, timeout=None):
+        # yields (model, priced option or exception) as each finishes; models past the timeout yield a TimeoutError.
+        # only queued models are cancelled - a running model can't be interrupted, so it finishes in the
+        # background (still holding its worker) and its result is discarded
+        models = list(self._model_map.keys()) if models is None else list(models)
+        if executor not in EXECUTORS:
+            raise Exception(f"<Option> Unknown executor - {executor} - Options: {list(EXECUTORS)}")
+        if executor == "process" and "Deep Q-Network" in models:
+            raise Exception("<Option> Deep Q-Network pricing can't leave the main process")
+
+        pool = EXECUTORS[executor](max_workers=max_workers or len(models))
+        if executor == "thread":
+            futures = {pool.submit(_with_script_context(self.priced), model): model for model in models}
+        else:
+            futures = {pool.submit(_price_remote, type(self), self._kwargs, model): model for model in models}
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = set(futures)
+        try:
+            while pending:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    error = future.exception()
+                    yield futures[future], future.result() if error is None else error
+                if not done:
+                    for future in pending:
+                        running = "" if future.cancel() else " - still running in the background"
+                        yield futures[future], TimeoutError(f"{futures[future]} exceeded {timeout}s{running}")
+                    return
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def all(self, **kwargs):
+        # priced options in completion order; failed or timed out models are kept in .failures
+        self.failures, priced = {}, []
+        for model, result in self.as_completed(**kwargs):
+            if isinstance(result, Exception):
+                self.failures[model] = result
+            else:
+                priced.append(result)
+        return priced
+
+
+class USOption(ConcurrentPricing, BaseOption):
     _model_map = {
         "Binomial Tree": USBinomialTree,
         "Deep Q-Network": None
@@ -24,10 +99,15 @@ class USOption(BaseOption):
         super().__init__(kwargs)
     
     def _dqn(self):
+        # a registered policy for this option's bucket prices without training; otherwise train
+        # (warm-started from the nearest registered agent) and register the result
         option = TFAModel(OptionEnv, self._kwargs)
-        option.init_agent()
-        option.build_replay_buffer()
-        option.train()
+        if not option.load_policy(POLICY_REGISTRY):
+            option.init_agent()
+            option.build_replay_buffer()
+            option.warm_start(POLICY_REGISTRY)
+            option.train()
+            option.save_policy(POLICY_REGISTRY)
         option.calculate_npv()
         priced_option = option
         return priced_option
@@ -35,13 +115,10 @@ class USOption(BaseOption):
     def priced(self, model: str):
         if model == "Deep Q-Network":
             return self._dqn()
-        return self._model_map[model](self._kwargs)
-
-    def all(self):
-        return [self.priced(model) for model in self._model_map.keys()]
+        return PRICING_CACHE.get_or_price("us", model, self._kwargs, self._model_map[model])
 
 
-class EUOption(BaseOption):
+class EUOption(ConcurrentPricing, BaseOption):
     _model_map = {
         "Black Scholes": BlackScholes,
         "Binomial Tree": EUBinomialTree,
@@ -53,13 +130,10 @@ class EUOption(BaseOption):
         super().__init__(kwargs)
     
     def priced(self, model: str):
-        return self._model_map[model](self._kwargs)
-    
-    def all(self):
-        return [self.priced(model) for model in self._model_map.keys()]
+        return PRICING_CACHE.get_or_price("eu", model, self._kwargs, self._model_map[model])
 
 
-class ASOption(BaseOption):
+class ASOption(ConcurrentPricing, BaseOption):
     _model_map = {
         "Monte Carlo": ASMonteCarlo
     }
@@ -69,7 +143,4 @@ class ASOption(BaseOption):
         super().__init__(kwargs)
     
     def priced(self, model: str):
-        return self._model_map[model](self._kwargs)
-    
-    def all(self):
-        return [self.priced(model) for model in self._model_map.keys()]
+        return PRICING_CACHE.get_or_price("as", model, self._kwargs, self._model_map[model])
@@ -1,4 +1,4 @@
-import requests, time
+import time
 import random
 import numpy as np
 import pandas as pd
@@ -8,12 +8,27 @@ from datetime import datetime
 
 from utils.tickers import read_tickers
 from utils.db_wrapper import clear_table, add_rows
+from utils.http_client import HttpClient
+from utils.spot_store import SpotPriceStore
+from utils.rate_curve import RateCurve
+from utils.snapshot_store import SnapshotStore
+
+class TickerPrices(dict):
+    # ticker -> last close, plus the tickers that needed the Polygon fallback, the ones that
+    # failed outright (ticker -> reason) and how long each stage of the fetch took in seconds
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fallbacks = []
+        self.failures = {}
+        self.timings = {}
+
 
 class Polygon:
     _headers: dict
     _base_url: str
 
-    def __init__(self, key=None, yf_backup=False, debugging=False):
+    def __init__(self, key=None, yf_backup=False, debugging=False, base_url='https://api.polygon.io/',
+                 requests_per_minute=5, max_workers=8, spot_ttl=None, rate_curve=None, snapshot_root="data/snapshots"):
         if key is None:
             with open('data/polygon.txt', 'r') as keyfile:
                 key = keyfile.readline().strip()
@@ -22,23 +37,28 @@ class Polygon:
             'Authorization': f'Bearer {key}'
         }
 
-        self._base_url = 'https://api.polygon.io/'
+        self._base_url = base_url
+        # the free plan allows 5 requests a minute; pass requests_per_minute=None for unlimited plans
+        self._client = HttpClient(base_url, headers=self._headers, requests_per_minute=requests_per_minute,
+                                  max_workers=max_workers)
+        # every spot lookup reads through one store, filled at most once per ticker per day (or spot_ttl seconds)
+        self._spots = SpotPriceStore(ttl=spot_ttl)
+        self._rate_curve = RateCurve() if rate_curve is None else rate_curve
+        self._snapshots = SnapshotStore(snapshot_root)
         self._yf_backup = yf_backup
         self._debugging = debugging
     
     @property
-    def risk_free_rate(self):
-        def deannualize(annual_rate, periods=(365//4)):
-            return (1 + annual_rate) ** (1/periods) - 1
-
-        def get_risk_free_rate():
-            annualized = yf.download("^IRX")["Adj Close"]
-            daily = annualized.apply(deannualize)
+    def rate_curve(self):
+        return self._rate_curve
 
-            return pd.DataFrame({"annualized": annualized, "trimonthly": daily})    
+    @property
+    def snapshots(self):
+        return self._snapshots
 
-        rates = get_risk_free_rate()
-        return float(rates["trimonthly"].iloc[-1])
+    @property
+    def risk_free_rate(self):
+        return self._rate_curve.trimonthly()
     
     @property
     def nasdaq_tickers(self):
@@ -48,43 +68,93 @@ class Polygon:
         return self._base_url + extension
 
     def _query(self, query: str):
-        full_query = self._get_req_url(query)
-        return requests.request("GET", url=full_query, headers=self._headers)
+        return self._client.get(self._get_req_url(query))
     
-    def _get_close_price_from_poly(self, ticker):
+    def _get_close_price_from_poly(self, ticker, refresh=False):
+        cached = None if refresh else self._spots.get(ticker)
+        if cached is not None:
+            return cached
+
         query = f"v2/aggs/ticker/{ticker}/prev?adjusted=true"
         previous_day_details = self._query(query).json()
         price_results = previous_day_details["results"][0]
         
         if "vw" in price_results:
-            return price_results["vw"] #volume weighted avg
+            price = price_results["vw"] #volume weighted avg
         else:
-            return price_results["c"] # close
+            price = price_results["c"] # close
+
+        self._spots.put(ticker, price)
+        return price
+
+    def _yf_close_prices(self, tickers):
+        # one multi-ticker download instead of a history() call per ticker
+        closes = yf.download(tickers, period="5d", progress=False, threads=True)["Close"]
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(tickers[0])
+        last = closes.ffill().iloc[-1] if len(closes) else pd.Series(dtype=float)
+        prices = {ticker: float(last[ticker]) for ticker in tickers if ticker in last and pd.notna(last[ticker])}
+        self._spots.update(prices)
+        return prices
+
+    def _poly_close_prices(self, tickers):
+        def fetch(ticker):
+            try:
+                return float(self._get_close_price_from_poly(ticker))
+            except Exception as error:
+                return error
+
+        return self._client.map(fetch, tickers)
+
+    def last_ticker_prices(self, refresh=False):
+        # the spot store first, then yfinance in bulk, then Polygon for whatever is still missing;
+        # failures & timings ride along on the result
+        tickers, start = self.nasdaq_tickers, time.perf_counter()
+        if refresh:
+            self._spots.invalidate()
+        prices = TickerPrices(self._spots.prices(tickers))
+
+        stale = [ticker for ticker in tickers if ticker not in prices]
+        if stale:
+            try:
+                prices.update(self._yf_close_prices(stale))
+            except Exception as error:
+                prices.failures["*"] = f"yfinance: {error}"
+        prices.timings["yfinance"] = time.perf_counter() - start
+
+        missing = [ticker for ticker in tickers if ticker not in prices]
+        fallback_start = time.perf_counter()
+        for ticker, result in self._poly_close_prices(missing).items():
+            if isinstance(result, Exception):
+                prices.failures[ticker] = f"polygon: {result}"
+            else:
+                prices[ticker] = result
+        prices.timings["polygon"] = time.perf_counter() - fallback_start
+        prices.timings["total"] = time.perf_counter() - start
+        prices.fallbacks = missing
+
+        return prices
 
-    def last_ticker_prices(self):
-        price_dict, tickers = {}, self.nasdaq_tickers
-        for ticker in tickers:
+    def spot_price(self, ticker, refresh=False):
+        cached = None if refresh else self._spots.get(ticker)
+        if cached is not None:
+            return cached
+        if self._yf_backup:
             try:
-                stock = yf.Ticker(ticker).history()
-                current_price = stock['Close'].iloc[-1]
-            except:
-                if self._debugging:
-                    with open("data/error_log.txt", "a") as f:
-                        f.write(f"<error> Ticker: {ticker}")
-
-                current_price = float(self._get_close_price_from_poly(ticker))
-            
-            price_dict[ticker] = current_price
-                
-        return price_dict
+                price = self._yf_close_prices([ticker]).get(ticker)
+            except Exception:
+                price = None # yfinance outages fall through to Polygon
+            if price is not None:
+                return price
+        return float(self._get_close_price_from_poly(ticker, refresh=True))
 
     @property
     def base_url(self):
         return self._base_url
     
     def _options_query(self, query: str):
-        time.sleep(12)
-        return self._query(f"v3/reference/options/contracts?{query}")
+        # every page of the contract listing, following next_url
+        return self._client.paginate(self._get_req_url(f"v3/reference/options/contracts?{query}"))
 
     def _polygon_options(self, ticker, position="", expired=""):
         if position:
@@ -97,11 +167,12 @@ class Polygon:
         return self._options_query(query)
     
     def _poly_ticker_contracts(self, ticker, expiration):
-        json_data = self._polygon_options(ticker).json()
-        ticker_data = pd.DataFrame(json_data["results"])
-        prices = self._get_eod_stock_prices(self.nasdaq_tickers)
-        ticker_data["mark"] = prices[ticker]
-        ticker_data["price"] = prices[ticker]
+        ticker_data = pd.DataFrame(self._polygon_options(ticker))
+        price = self.spot_price(ticker)
+        ticker_data["mark"] = price
+        ticker_data["price"] = price
+
+        return ticker_data
     
     def _yf_ticker_contracts(self, ticker, expiration):
         random.seed(31337)
@@ -130,27 +201,13 @@ class Polygon:
         return ticker_data
 
     def _get_eod_options_data(self, tickers):
-        all_ticker_options_data = []
-        for ticker in tickers:
-            json_data = self._polygon_options(ticker).json()
-            ticker_data = pd.DataFrame(json_data["results"])
-            all_ticker_options_data.append(ticker_data)
-        
+        contracts = self._client.map(self._polygon_options, tickers)
+        all_ticker_options_data = [pd.DataFrame(contracts[ticker]) for ticker in tickers]
+
         return pd.concat(all_ticker_options_data).sort_index(kind='merge')
     
     def _get_eod_stock_prices(self, tickers):
-        ticker_prices = {}
-        for ticker in tickers:
-            query = f"v2/aggs/ticker/{ticker}/prev?adjusted=true"
-            previous_day_details = self._query(query).json()
-            price_results = previous_day_details["results"][0]
-            
-            if "vw" in price_results:
-                ticker_prices[ticker] = price_results["vw"] #volume weighted avg
-            else:
-                ticker_prices[ticker] = price_results["c"] # close
-        
-        return ticker_prices
+        return self._client.map(self._get_close_price_from_poly, tickers)
 
     def exchange_status(self, exchange): # i.e. nasdaq -> open, closed, after-hours
         query = "v1/marketstatus/now?"
@@ -161,18 +218,18 @@ class Polygon:
         return options.get_expiration_dates(ticker.lower())[1:]
 
     def store_all_eod_data(self):
-        clear_table()
+        # the day's chains & spots are appended to the parquet history; sqlite only keeps the latest load
+        if self._yf_backup:
+            raise Exception("<Polygon> EOD chain storage needs Polygon contract data - set yf_backup=False")
 
-        data_methods = {True: self._yf_get_eod_options_data, False: self._get_eod_options_data}
         tickers = read_tickers()
+        eod_data = self._get_eod_options_data(tickers)
+        current_stock_prices = self._get_eod_stock_prices(tickers)
 
-        eod_data = data_methods[self._yf_backup](tickers)
-
-        if self._yf_backup:
-            current_stock_prices = yf_current_prices(tickers)
-        else:
-            current_stock_prices = self._get_eod_stock_prices(tickers)
+        self._snapshots.append_spots(current_stock_prices)
+        self._snapshots.append_chains(eod_data, current_stock_prices)
 
+        clear_table()
         add_rows(eod_data, current_stock_prices)
     
     def get_ticker_contracts_given_exp(self, ticker, expiration: str):
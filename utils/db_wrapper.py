@@ -1,34 +1,90 @@
-from notanorm import SqliteDb 
+import sqlite3
+import threading
 from utils.tickers import read_tickers
 
 import yfinance as yf
 import pandas as pd
-from datetime import datetime
-# from notanorm import MysqlDb 
 
-# accepts all the same parameters as sqlite3.connect
-db = SqliteDb("data/options_data.db")
+DB_PATH = "data/options_data.db"
+COLUMNS = ("underlying_ticker", "ticker", "contract_type", "expiration_date", "strike_price", "spot_price")
+EXPIRATION_FORMAT = '%Y-%m-%d %H:%M:%S'
+# chain lookups filter on both columns; the composite index also serves underlying-only queries
+INDEXES = {
+    "options_underlying_expiration": ("underlying_ticker", "expiration_date"),
+    "options_expiration_date": ("expiration_date",),
+}
 
-def _setup_db():
-    db.query("create table options (underlying_ticker text, ticker text, contract_type text, expiration_date datetime, strike_price integer, spot_price float)")
+_lock = threading.Lock()
+
+def connect(path=DB_PATH):
+    con = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets the app read while a bulk load is writing
+    con.execute("pragma journal_mode=wal")
+    con.execute("pragma synchronous=normal")
+    _setup_db(con)
+    return con
+
+def _setup_db(con):
+    with con:
+        con.execute("create table if not exists options (underlying_ticker text, ticker text, contract_type text, expiration_date datetime, strike_price integer, spot_price float)")
+        # one row per contract: reloading a chain replaces it instead of duplicating it
+        con.execute("create unique index if not exists options_ticker on options (ticker)")
+        for name, columns in INDEXES.items():
+            con.execute(f"create index if not exists {name} on options ({', '.join(columns)})")
+
+def _format_expiration(expiration):
+    # the stored text form; writes & lookups share it so equality filters match
+    if isinstance(expiration, pd.Series):
+        return pd.to_datetime(expiration, format='%Y-%m-%d').dt.strftime(EXPIRATION_FORMAT)
+    return pd.Timestamp(expiration).strftime(EXPIRATION_FORMAT)
+
+db = connect()
+
+def query(sql, params=(), con=None):
+    return pd.read_sql_query(sql, db if con is None else con, params=params)
+
+def _insert(rows, con=None):
+    con = db if con is None else con
+    placeholders = ", ".join("?" for _ in COLUMNS)
+    with _lock, con:
+        con.executemany(f"insert or replace into options ({', '.join(COLUMNS)}) values ({placeholders})", rows)
 
 def add_row(underlying_ticker, ticker, contract_type, expiration_date, strike_price, price_dict=None):
     if price_dict is None:
         raise Exception("No Price Dict")
-    date = datetime.strptime(expiration_date, '%Y-%m-%d')
-    db.insert("options", underlying_ticker=underlying_ticker, ticker=ticker, contract_type=contract_type, expiration_date=date, strike_price=strike_price, spot_price=price_dict[underlying_ticker])
-    
-    
-def add_rows(dataframe : pd.DataFrame, price_dict=None):
-    for _, row in dataframe.iterrows():
-        add_row("options", row["underlying_ticker"], row["ticker"], row["contract_type"], row["expiration_date"], row["strike_price"], price_dict)
+    _insert([(underlying_ticker, ticker, contract_type, _format_expiration(expiration_date), strike_price,
+              price_dict[underlying_ticker])])
+
+def add_rows(dataframe : pd.DataFrame, price_dict=None, con=None):
+    # the whole frame goes in as one executemany inside a single transaction
+    if price_dict is None:
+        raise Exception("No Price Dict")
+    missing = set(dataframe["underlying_ticker"]) - set(price_dict)
+    if missing:
+        raise Exception(f"<DB> No spot price for - {sorted(missing)}")
+
+    rows = pd.DataFrame({
+        "underlying_ticker": dataframe["underlying_ticker"],
+        "ticker": dataframe["ticker"],
+        "contract_type": dataframe["contract_type"],
+        "expiration_date": _format_expiration(dataframe["expiration_date"]),
+        "strike_price": dataframe["strike_price"],
+        "spot_price": dataframe["underlying_ticker"].map(price_dict).astype(float),
+    })
+    _insert(rows.itertuples(index=False, name=None), con)
+
+def read_rows_of_ticker(con, ticker):
+    return query("SELECT * FROM options WHERE ticker = ?", (ticker,), con)
 
-def read_rows_of_ticker(con, ticker): 
-    return pd.read_sql_query(f"SELECT * FROM options WHERE ticker = {ticker}", con)
+def read_rows_of_underlying(con, underlying_ticker, expiration_date=None):
+    if expiration_date is None:
+        return query("SELECT * FROM options WHERE underlying_ticker = ?", (underlying_ticker,), con)
+    return query("SELECT * FROM options WHERE underlying_ticker = ? AND expiration_date = ?",
+                 (underlying_ticker, _format_expiration(expiration_date)), con)
 
-def read_rows(con): 
-    return pd.read_sql_query(f"SELECT * FROM options", con)
+def read_rows(con):
+    return query("SELECT * FROM options", con=con)
 
 def clear_table():
-    db.delete_all("options")
-    
+    with _lock, db:
+        db.execute("delete from options")
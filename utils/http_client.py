@@ -0,0 +1,99 @@
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int = 1):
+        # rate is tokens per second; capacity is the largest burst allowed
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+            # claim the token now and sleep off the deficit outside the lock's bookkeeping
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+class HttpClient:
+    def __init__(self, base_url: str, headers=None, requests_per_minute=None, burst: int = 1, max_workers: int = 8,
+                 max_retries: int = 5, backoff: float = 1.0, timeout: float = 30):
+        self._base_url = base_url
+        self._max_workers = max_workers
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._limiter = None if requests_per_minute is None else TokenBucket(requests_per_minute / 60, burst)
+
+        # one pooled session for every request so connections (and TLS handshakes) are reused
+        self._session = requests.Session()
+        self._session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    def url(self, path: str):
+        return path if path.startswith(("http://", "https://")) else self._base_url + path
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self._backoff * 2 ** attempt
+
+    def get(self, path: str, params=None):
+        response = None
+        for attempt in range(self._max_retries + 1):
+            if self._limiter is not None:
+                self._limiter.acquire()
+            try:
+                response = self._session.get(self.url(path), params=params, timeout=self._timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self._max_retries:
+                    raise
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self._max_retries:
+                    break
+            time.sleep(self._retry_delay(response, attempt))
+
+        response.raise_for_status()
+        return response
+
+    def paginate(self, path: str, params=None, key: str = "results"):
+        # follows next_url until the last page; only the first request carries the query params
+        results = []
+        next_url = path
+        while next_url:
+            payload = self.get(next_url, params).json()
+            results.extend(payload.get(key, []))
+            next_url, params = payload.get("next_url"), None
+        return results
+
+    def map(self, fn, items):
+        # fans fn out over items on a bounded pool; the token bucket still paces the requests underneath
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, max(len(items), 1))) as pool:
+            return dict(zip(items, pool.map(fn, items)))
+
+    def close(self):
+        self._session.close()
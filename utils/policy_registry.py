@@ -0,0 +1,94 @@
+import os
+import json
+import math
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+
+# bucket widths: options landing in the same bucket of every feature share a trained policy
+BUCKETS = {"moneyness": 0.05, "implied_volatility": 0.05, "risk_free_rate": 0.005, "time": 1 / 12}
+
+class PolicyRegistry:
+    def __init__(self, root="data/policies", buckets=None, max_distance=3.0):
+        self._root = root
+        self._buckets = dict(BUCKETS if buckets is None else buckets)
+        self._max_distance = max_distance
+        self._lock = threading.Lock()
+
+    def features(self, params):
+        return {
+            "moneyness": float(params["spot"]) / float(params["strike"]),
+            "implied_volatility": float(params["implied_volatility"]),
+            "risk_free_rate": float(params["risk_free_rate"]),
+            "time": (params["maturity"] - date.today()) / timedelta(days=365),
+        }
+
+    def key(self, params):
+        # the epsilon keeps values sitting on a bucket edge (e.g. 0.15 / 0.05) out of the bucket below
+        buckets = (math.floor(value / self._buckets[name] + 1e-9) for name, value in self.features(params).items())
+        return f"{params['option_type']}_" + "_".join(str(bucket) for bucket in buckets)
+
+    def path(self, key):
+        return os.path.join(self._root, key)
+
+    def _index_path(self):
+        return os.path.join(self._root, "index.json")
+
+    def _read_index(self):
+        if not os.path.exists(self._index_path()):
+            return {}
+        with open(self._index_path(), "r") as f:
+            return json.load(f)
+
+    def entry(self, params):
+        with self._lock:
+            return self._read_index().get(self.key(params))
+
+    def nearest(self, params):
+        # closest registered policy of the same option type, measured in bucket widths
+        features, option_type = self.features(params), params["option_type"]
+        best, best_distance = None, self._max_distance
+        with self._lock:
+            entries = self._read_index().values()
+        for entry in entries:
+            if entry["option_type"] != option_type:
+                continue
+            distance = math.sqrt(sum(((entry["features"][name] - value) / self._buckets[name]) ** 2
+                                     for name, value in features.items()))
+            if distance <= best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def supersedes(self, params, train_steps):
+        # a bucket's policy is only replaced by one trained at least as long
+        entry = self.entry(params)
+        return entry is None or int(train_steps) >= entry["train_steps"]
+
+    def register(self, params, train_steps):
+        # called once the policy & checkpoint are written under path(key); a longer-trained entry is kept
+        key = self.key(params)
+        entry = {
+            "key": key,
+            "option_type": params["option_type"],
+            "features": self.features(params),
+            "strike": float(params["strike"]),
+            "train_steps": int(train_steps),
+            "saved": datetime.now().isoformat(timespec="seconds"),
+            "policy": os.path.join(self.path(key), "policy"),
+            "checkpoint": os.path.join(self.path(key), "checkpoint"),
+        }
+        with self._lock:
+            index = self._read_index()
+            if key in index and index[key]["train_steps"] > entry["train_steps"]:
+                return index[key]
+            index[key] = entry
+            os.makedirs(self._root, exist_ok=True)
+            tmp_path = self._index_path() + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=2)
+            os.replace(tmp_path, self._index_path())
+        return entry
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self._root, ignore_errors=True)
@@ -0,0 +1,126 @@
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from models.abstract import detached
+
+KEY_FIELDS = ("option_type", "spot", "strike", "implied_volatility", "risk_free_rate", "dividend_rate", "maturity")
+# only the numbers go to disk; plots & monte carlo paths are recomputed on demand
+PERSISTED = ("inputs", "npv", "greeks", "estimate")
+PERSISTED_ESTIMATE = ("npv", "stderr", "scenarios_used")
+
+class PricingCache:
+    def __init__(self, maxsize: int = 512, ttl: float = 3600, decimals: int = 6, disk_path=None,
+                 max_disk_rows: int = 10_000):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._decimals = decimals
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._disk_path = disk_path
+        self._max_disk_rows = max_disk_rows
+        self._disk = None
+
+        self.hits, self.disk_hits, self.misses, self.evictions = 0, 0, 0, 0
+
+    def normalize(self, params):
+        normalized = {}
+        for field in KEY_FIELDS:
+            value = params[field]
+            normalized[field] = round(float(value), self._decimals) if isinstance(value, (int, float)) else value
+        return normalized
+
+    def key(self, region, model, params):
+        # the valuation date is part of the key: time to maturity moves every day
+        normalized = self.normalize(params)
+        return (region, model, date.today().isoformat()) + tuple(str(normalized[field]) for field in KEY_FIELDS)
+
+    def _connect(self):
+        if self._disk is None and self._disk_path is not None:
+            self._disk = sqlite3.connect(self._disk_path, check_same_thread=False)
+            self._disk.execute("pragma journal_mode=wal")
+            self._disk.execute("create table if not exists pricing_cache (key text primary key, expires real, results blob)")
+            self._disk.execute("create index if not exists pricing_cache_expires on pricing_cache (expires)")
+        return self._disk
+
+    def _disk_get(self, key):
+        disk = self._connect()
+        if disk is None:
+            return None
+        row = disk.execute("select expires, results from pricing_cache where key = ?", (repr(key),)).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return pickle.loads(row[1])
+
+    def _disk_put(self, key, results):
+        disk = self._connect()
+        if disk is None:
+            return
+        persisted = {k: v for k, v in results.items() if k in PERSISTED}
+        if "estimate" in persisted:
+            persisted["estimate"] = {k: v for k, v in persisted["estimate"].items() if k in PERSISTED_ESTIMATE}
+        try:
+            blob = pickle.dumps(detached(persisted))
+        except Exception:
+            return # unpicklable results simply stay in memory
+        now = time.time()
+        with disk:
+            disk.execute("insert or replace into pricing_cache values (?, ?, ?)", (repr(key), now + self._ttl, blob))
+            # keys carry the valuation date, so stale rows are never read again; expire them & cap the rest
+            disk.execute("delete from pricing_cache where expires < ?", (now,))
+            disk.execute("delete from pricing_cache where key not in "
+                         "(select key from pricing_cache order by expires desc limit ?)", (self._max_disk_rows,))
+
+    def _remember(self, key, model):
+        self._entries[key] = (time.time() + self._ttl, model)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_price(self, region, model, params, factory):
+        key = self.key(region, model, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            results = self._disk_get(key)
+
+        priced = factory(self.normalize(params))
+        if results is not None and results.get("inputs") == priced._input_key():
+            priced._results = results
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, priced)
+            return priced
+
+        priced.evaluate()
+        with self._lock:
+            self.misses += 1
+            self._remember(key, priced)
+            self._disk_put(key, priced._results)
+        return priced
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            disk = self._connect()
+            if disk is not None:
+                with disk:
+                    disk.execute("delete from pricing_cache")
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
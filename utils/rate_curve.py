@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from datetime import date, timedelta
+
+# treasury yield indices (quoted in percent) and their tenors in years
+TENORS = {"^IRX": 0.25, "^FVX": 5.0, "^TNX": 10.0, "^TYX": 30.0}
+
+logger = logging.getLogger(__name__)
+
+def deannualize(annual_rate, periods=(365//4)):
+    return (1 + annual_rate) ** (1/periods) - 1
+
+class RateCurve:
+    def __init__(self, path="data/risk_free_rates.csv", symbols=tuple(TENORS), offline=False):
+        # offline curves never download; they only read what is already on disk (e.g. a test fixture)
+        self._path = path
+        self._symbols = list(symbols)
+        self._offline = offline
+        self._history = None
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_history(cls, history: pd.DataFrame):
+        curve = cls(path=None, symbols=list(history.columns), offline=True)
+        curve._history = history.sort_index()
+        return curve
+
+    def _load(self):
+        if self._path is None or not os.path.exists(self._path):
+            return pd.DataFrame(columns=self._symbols, dtype=float)
+        return pd.read_csv(self._path, index_col=0, parse_dates=True)
+
+    def _download(self, start):
+        closes = yf.download(self._symbols, start=start, progress=False, auto_adjust=False)["Adj Close"]
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(self._symbols[0])
+        return closes.dropna(how="all")
+
+    def refresh(self):
+        # only the days after the last cached row are downloaded, at most once a day
+        with self._lock:
+            if self._history is None:
+                self._history = self._load()
+            if self._offline or self._refreshed == date.today():
+                return self._history
+
+            start = None if self._history.empty else (self._history.index.max() + timedelta(days=1)).date()
+            if start is None or start <= date.today():
+                try:
+                    fresh = self._download(start)
+                except Exception as error:
+                    # a failed top-up keeps pricing on the cached curve; without one there is nothing to price on
+                    if self._history.empty:
+                        raise Exception(f"<Rates> Rate download failed with no cached history - {error}")
+                    logger.warning("<Rates> Rate download failed, using history up to %s - %s",
+                                   self._history.index.max().date(), error)
+                    fresh = self._history.iloc[:0]
+                fresh = fresh[~fresh.index.isin(self._history.index)]
+                if len(fresh):
+                    self._history = pd.concat([self._history, fresh]).sort_index()
+                    if self._path is not None:
+                        self._history.to_csv(self._path)
+            self._refreshed = date.today()
+            return self._history
+
+    @property
+    def history(self):
+        return self.refresh()
+
+    def latest(self):
+        # last quote of each index in percent, keyed by tenor in years
+        history = self.history
+        if history.empty:
+            raise Exception(f"<Rates> No rate history{' (offline)' if self._offline else ''} - Path: {self._path}")
+        last = history.ffill().iloc[-1].dropna()
+        return {TENORS.get(symbol, 0.25): float(last[symbol]) for symbol in last.index}
+
+    def term_structure(self):
+        # continuously compounded zero rates (decimal) per tenor
+        tenors = sorted(self.latest().items())
+        return pd.Series({tenor: np.log1p(quote / 100) for tenor, quote in tenors}, name="zero_rate")
+
+    def zero_rate(self, t):
+        # linear in tenor between the quoted points, flat beyond them; t is in years
+        curve = self.term_structure()
+        rates = np.interp(np.asarray(t, dtype=np.float64), curve.index.to_numpy(), curve.to_numpy())
+        return float(rates) if np.ndim(rates) == 0 else rates
+
+    def discount_factor(self, t):
+        return np.exp(-self.zero_rate(t) * np.asarray(t, dtype=np.float64))
+
+    def trimonthly(self):
+        # the last ^IRX quote deannualized over a quarter, as Polygon.risk_free_rate has always reported it
+        return float(deannualize(self.history["^IRX"].dropna().iloc[-1]))
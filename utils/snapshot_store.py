@@ -0,0 +1,108 @@
+# Date-partitioned Parquet snapshots of EOD option chains & spot prices
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from datetime import date
+
+from models.batch import year_fraction
+
+SNAPSHOT_KINDS = ("chains", "spots")
+PARTITIONING = ds.partitioning(pa.schema([("snapshot_date", pa.string())]), flavor="hive")
+
+class SnapshotStore:
+    def __init__(self, root="data/snapshots"):
+        self._root = root
+
+    def _path(self, kind):
+        if kind not in SNAPSHOT_KINDS:
+            raise Exception(f"<Snapshots> Unknown kind - {kind} - Options: {list(SNAPSHOT_KINDS)}")
+        return os.path.join(self._root, kind)
+
+    def append(self, kind, frame: pd.DataFrame, snapshot_date=None, sort_by=()):
+        # a call replaces its date's partition, so re-running a day's pull doesn't duplicate it; other days are untouched
+        snapshot_date = (snapshot_date or date.today()).isoformat()
+        if sort_by:
+            # sorted row groups keep the parquet min/max statistics tight enough to skip on filters
+            frame = frame.sort_values(list(sort_by), kind="stable")
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.append_column("snapshot_date", pa.array([snapshot_date] * len(table), pa.string()))
+
+        ds.write_dataset(table, self._path(kind), format="parquet", partitioning=PARTITIONING,
+                         basename_template="part-{i}.parquet",
+                         existing_data_behavior="delete_matching", max_rows_per_group=64_000)
+        return len(table)
+
+    def append_chains(self, contracts: pd.DataFrame, spot_prices=None, snapshot_date=None):
+        contracts = contracts.copy()
+        if spot_prices is not None:
+            contracts["spot_price"] = contracts["underlying_ticker"].map(spot_prices).astype(float)
+        return self.append("chains", contracts, snapshot_date, sort_by=("underlying_ticker", "expiration_date"))
+
+    def append_spots(self, spot_prices: dict, snapshot_date=None):
+        frame = pd.DataFrame({"ticker": list(spot_prices), "spot_price": [float(p) for p in spot_prices.values()]})
+        return self.append("spots", frame, snapshot_date, sort_by=("ticker",))
+
+    def dates(self, kind):
+        path = self._path(kind)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name.split("=", 1)[1] for name in os.listdir(path) if name.startswith("snapshot_date="))
+
+    def read(self, kind, snapshot_date=None, start=None, end=None, underlying=None, tickers=None, expiration=None,
+             columns=None) -> pa.Table:
+        # filters are pushed down: whole date partitions and non-matching row groups are never read
+        if not self.dates(kind):
+            raise Exception(f"<Snapshots> No {kind} snapshots - Path: {self._path(kind)}")
+        dataset = ds.dataset(self._path(kind), format="parquet", partitioning=PARTITIONING)
+
+        conditions = []
+        if snapshot_date is not None:
+            conditions.append(ds.field("snapshot_date") == str(snapshot_date))
+        if start is not None:
+            conditions.append(ds.field("snapshot_date") >= str(start))
+        if end is not None:
+            conditions.append(ds.field("snapshot_date") <= str(end))
+        if underlying is not None:
+            conditions.append(ds.field("underlying_ticker").isin(np.atleast_1d(underlying).tolist()))
+        if tickers is not None:
+            conditions.append(ds.field("ticker").isin(np.atleast_1d(tickers).tolist()))
+        if expiration is not None:
+            conditions.append(ds.field("expiration_date").isin([str(e) for e in np.atleast_1d(expiration)]))
+
+        condition = None
+        for part in conditions:
+            condition = part if condition is None else condition & part
+        return dataset.to_table(columns=columns, filter=condition)
+
+    def latest(self, kind, **filters):
+        dates = self.dates(kind)
+        return self.read(kind, snapshot_date=dates[-1] if dates else None, **filters)
+
+def _numpy(column: pa.ChunkedArray, dtype=np.float64):
+    # single-chunk, null-free numeric columns are viewed in place; anything else is copied once
+    if column.num_chunks == 1 and column.null_count == 0 and pa.types.is_floating(column.type):
+        return column.chunk(0).to_numpy(zero_copy_only=True)
+    return column.to_numpy().astype(dtype)
+
+def chain_table_inputs(chains: pa.Table, implied_volatility, risk_free_rate=0.0, dividend_rate=0.0):
+    # the same dict chain_inputs builds, read straight off an arrow table of polygon contracts;
+    # implied_volatility is either values or the name of a column in the table
+    n = chains.num_rows
+    time = year_fraction(chains.column("expiration_date").to_numpy(zero_copy_only=False))
+    if isinstance(implied_volatility, str):
+        implied_volatility = _numpy(chains.column(implied_volatility))
+    if hasattr(risk_free_rate, "zero_rate"):
+        risk_free_rate = risk_free_rate.zero_rate(time)
+    contract_type = chains.column("contract_type").to_numpy(zero_copy_only=False)
+
+    return {
+        "option_type": np.where(contract_type == "call", "C", "P"),
+        "spot": _numpy(chains.column("spot_price")),
+        "strike": _numpy(chains.column("strike_price")),
+        "time": time,
+        "implied_volatility": np.broadcast_to(np.asarray(implied_volatility, dtype=np.float64), (n,)),
+        "risk_free_rate": np.broadcast_to(np.asarray(risk_free_rate, dtype=np.float64), (n,)),
+        "dividend_rate": np.broadcast_to(np.asarray(dividend_rate, dtype=np.float64), (n,)),
+    }
@@ -0,0 +1,54 @@
+import time
+import threading
+from datetime import date
+
+class SpotPriceStore:
+    def __init__(self, ttl=None):
+        # prices never outlive the trading day they were fetched on; ttl (seconds) can shorten that further
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, entry):
+        day, fetched, _ = entry
+        return day == date.today() and (self._ttl is None or time.time() - fetched <= self._ttl)
+
+    def get(self, ticker):
+        with self._lock:
+            entry = self._entries.get(ticker)
+            if entry is None or not self._fresh(entry):
+                return None
+            return entry[2]
+
+    def put(self, ticker, price):
+        with self._lock:
+            self._entries[ticker] = (date.today(), time.time(), float(price))
+
+    def update(self, prices: dict):
+        for ticker, price in prices.items():
+            self.put(ticker, price)
+
+    def prices(self, tickers):
+        found = {}
+        for ticker in tickers:
+            price = self.get(ticker)
+            if price is not None:
+                found[ticker] = price
+        return found
+
+    def missing(self, tickers):
+        return [ticker for ticker in tickers if self.get(ticker) is None]
+
+    def invalidate(self, ticker=None):
+        with self._lock:
+            if ticker is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(ticker, None)
+
+    def __contains__(self, ticker):
+        return self.get(ticker) is not None
+
+    def __len__(self):
+        with self._lock:
+            return sum(self._fresh(entry) for entry in self._entries.values())